@@ -1,18 +1,37 @@
 #%%
 import io
 import pandas as pd
-import requests
+from api_connect.cache import cached_get
+from api_connect.frequency import convert_frequency, identify_freq, set_date_freq
+from api_connect.history import merge_history
 
 
 class BoeApi:
-    def __init__(self, series_code):
+    endpoint = (
+        "https://www.bankofengland.co.uk/boeapps/iadb/fromshowcolumns.asp?csv.x=yes"
+    )
+    # Series codes per request in the batched path. The IADB request is a GET,
+    # so the comma separated code list is bounded by the URL length.
+    chunk_size = 50
+
+    def __init__(self, series_code, cache=None, ts_df=None):
+        """
+
+        Args:
+            series_code (str): IADB series code.
+            cache (BaseCache, optional): Response cache. Defaults to None.
+            ts_df (pandas.DataFrame, optional): Already retrieved time-series, e.g.
+                from BoeApi.batch. No request is issued if given. Defaults to None.
+
+        No request is issued on creation; the content is retrieved when the data is
+        first needed, or when 'fetch' is called.
+        """
         self.series_code = series_code
-        self.endpoint = (
-            "https://www.bankofengland.co.uk/boeapps/iadb/fromshowcolumns.asp?csv.x=yes"
-        )
+        self.cache = cache
         self.date_freq = None
         self.interporlated = None
-        self._get_content()
+        self._df = ts_df
+        self._content = None  # Retrieved on first access, see fetch.
         
     def __repr__(self):
         api = "API: BOE"
@@ -21,71 +40,145 @@ class BoeApi:
         interporlated = f"Interpolation: {self.interporlated}"
         return " / ".join([api, series, date_freq, interporlated])
 
-    def _get_content(self):
-        self.params = {
+    @property
+    def content(self):
+        """ Raw response content, retrieved on first access.
+        """
+        if self._content is None:
+            self._get_content()
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+
+    @property
+    def is_fetched(self):
+        return self._df is not None or self._content is not None
+
+    def fetch(self):
+        """ Retrieve the content now, unless the time-series is already held.
+
+        Returns:
+            BoeApi: self
+        """
+        if not self.is_fetched:
+            self._get_content()
+        return self
+
+    @classmethod
+    def _request(cls, series_codes, cache=None, start_date=None, revalidate=False):
+        params = {
             "DAT": "ALL",
-            "SeriesCodes": self.series_code,
+            "SeriesCodes": series_codes,
             "CSVF": "TN",
             "UsingCodes": "Y",
             "VPD": "Y",
             "VFD": "N",
         }
-        self.req = requests.get(self.endpoint, params=self.params)
+        if start_date is not None:
+            del params["DAT"]
+            params["Datefrom"] = start_date.strftime("%d/%b/%Y")
+            params["Dateto"] = "now"
+        status_code, content = cached_get(
+            cls.endpoint, params=params, cache=cache, source="BOE", revalidate=revalidate
+        )
 
-        if self.req.status_code == 404:
+        if status_code == 404:
             raise ConnectionError(
-                f"A 404 was issued. CCeck input parameters: {self.series_code}"
+                f"A 404 was issued. CCeck input parameters: {series_codes}"
             )
-        else:
-            self.content = self.req.content
+        return params, content
 
-    def _ts_df(self):
-        return pd.read_csv(
-            io.BytesIO(self.content), parse_dates=["DATE"], index_col=["DATE"]
-        )
-        
-    @staticmethod
-    def _freq_to_n_month(date_freq, shift=0):
-        """ 
+    def _get_content(self):
+        self.params, self.content = self._request(self.series_code, self.cache)
+
+    @classmethod
+    def batch(cls, api_params, cache=None):
+        """ Retrieve many series with as few requests as possible.
+
+        Series codes are sent as a comma separated 'SeriesCodes' list in chunks of
+        'chunk_size'. Each combined CSV is parsed once into a wide dataframe and
+        split back per series.
 
         Args:
-            date_freq (str): date frequency, m / q / y.
-            n (int, optional): Index shift to an alternative frequency. Defaults to 0.
+            api_params (list): List of BoeApi input parameters.
+            cache (BaseCache, optional): Response cache. Defaults to None.
 
         Returns:
-            str: ONS frequency.
+            list: BoeApi objects in the order of api_params, None for series codes
+                missing from the response.
         """
-        freq = {"y":1, "q":4, "m":12}
-        freq_index = list(freq).index(date_freq)
-        return list(freq.values())[freq_index + shift]
+        series_codes = list(dict.fromkeys(params["series_code"] for params in api_params))
+        dfs = {}
+        for i in range(0, len(series_codes), cls.chunk_size):
+            _, content = cls._request(",".join(series_codes[i : i + cls.chunk_size]), cache)
+            df = cls._parse_content(content)
+            for code in df.columns:
+                # Series at different frequencies share the combined date index.
+                dfs[code] = df[[code]].dropna(how="all")
 
-    def _freq_identify(self, df):
-        """ Identify the date frequency of the time-series dataframe.
+        return [
+            cls(params["series_code"], cache=cache, ts_df=dfs[params["series_code"]])
+            if params["series_code"] in dfs
+            else None
+            for params in api_params
+        ]
 
-        Args:
-            df (pandas.DataFrame): Time-series dataframe.
+    @staticmethod
+    def _parse_content(content):
+        return pd.read_csv(io.BytesIO(content), parse_dates=["DATE"], index_col=["DATE"])
+
+    def _ts_df(self):
+        if self._df is None:
+            self._df = self._parse_content(self.content)
+        return self._df
+
+    def get_raw_series(self):
+        """ Retrieve the held time-series at its native frequency.
 
         Returns:
-            tuple(int, str): # of unique months, date frequency.
+            dict: Time-series dataframe per frequency (d / m / q / y).
         """
-        n_month = df.index.month.nunique()
-        freq = {1: "y", 4: "q", 12: "m"}
-        return (n_month, freq.get(n_month))
-    
-    def _interporlate_ts(self, df, date_freq):
-        """ Interpolate Time-series (date-indexed) dataframe.
+        df = self._ts_df()
+        _, freq = identify_freq(df.index)
+        if len(df) > df.index.to_period("M").nunique():  # Several observations per month.
+            freq = "d"
+        return {freq: df}
+
+    @classmethod
+    def from_raw_series(cls, api_params, raw_series, cache=None):
+        return cls(**api_params, cache=cache, ts_df=next(iter(raw_series.values())))
+
+    def update(self, overlap=3):
+        """ Retrieve observations from the last held date, less an overlap window
+        to pick up revisions, and merge them into the held time-series. The
+        request bypasses the cache TTL.
 
         Args:
-            df (pandas.DataFrame): Time-series dataframe.
-            date_freq (str): Resampling frequency (m/q/y)
+            overlap (int, optional): Overlap window in months. Defaults to 3.
 
         Returns:
-            pd.DataFrame: Interporlated time-series dataframe.
+            pandas.DataFrame: Added / revised points.
         """
-        self.interporlated = True
-        return df.resample(date_freq).interpolate(method="spline", order=3, s=0.0)
-    
-    def get_time_series(self, date_freq):
+        df = self._ts_df()
+        start_date = df.index.max() - pd.DateOffset(months=overlap)
+        _, content = self._request(self.series_code, self.cache, start_date, revalidate=True)
+        self._df, report = merge_history(df, self._parse_content(content)[[self.series_code]])
+        return report
+        
+    def get_native_series(self, date_freq=None):
+        """ Retrieve the held time-series at its native frequency.
+
+        Returns:
+            pandas.DataFrame: Time-series dataframe.
+        """
+        df = self._ts_df()
+        if "date_freq" not in df.attrs:  # Identified once per held series.
+            set_date_freq(df, next(iter(self.get_raw_series())))
+        return df
+
+    def get_time_series(self, date_freq, method="spline"):
         """ Retrieve time-series dataframe based on input date frequency.
         
         If date frequency input is more granular than the available date frequency, 
@@ -93,21 +186,18 @@ class BoeApi:
 
         Args:
             date_freq (str): m / q / y
+            method (str, optional): Interpolation method. Defaults to "spline".
 
         Returns:
             pandas.DataFrame: Time-series dataframe.
         """
         self.date_freq = date_freq
-        df = self._ts_df()
-        n_month, freq = self._freq_identify(df)
-        target_n_month = self._freq_to_n_month(date_freq)
-        if target_n_month > n_month: # Interporlation required.
-            df = df.resample(date_freq).asfreq()
-            # Last index with non NaN entry.
-            valid_loc = df.index.get_loc(df.iloc[:, 0].last_valid_index())
-            df = df.iloc[: valid_loc + 1, :]  # Exclude last NaN row.
-            return self._interporlate_ts(df, date_freq)
-        else:
-            return df.resample(date_freq).asfreq()
+        native_df = self.get_native_series()
+        df, interpolated = convert_frequency(
+            native_df, date_freq, method, [native_df.attrs["date_freq"]]
+        )
+        self.interporlated = method if interpolated.values.any() else None
+        return df
+
 
 # %%
@@ -0,0 +1,196 @@
+#%%
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from api_connect.transport import get_transport
+
+
+class BaseCache:
+    """ Response cache interface used by the API connectors.
+
+    A cache stores the raw payload of a response together with the validators
+    (ETag / Last-Modified) returned by the server. Entries older than 'ttl' seconds
+    are stale and revalidated with a conditional request where the endpoint
+    supports it. Subclasses implement get / set / touch.
+    """
+
+    def __init__(self, ttl=86400):
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(source, params):
+        """ Cache key based on the API source and the request parameters.
+
+        Args:
+            source (str): API name, e.g. ONS / BOE / HMLR.
+            params (dict): Request parameters.
+
+        Returns:
+            str: Hex digest key.
+        """
+        raw = json.dumps([source, params], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    @staticmethod
+    def validators(entry):
+        """ Conditional request headers for a cached entry.
+
+        Args:
+            entry (dict): Cache entry.
+
+        Returns:
+            dict: HTTP headers.
+        """
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, payload, etag=None, last_modified=None):
+        raise NotImplementedError
+
+    def touch(self, key):
+        raise NotImplementedError
+
+
+class DiskCache(BaseCache):
+    """ On-disk response cache with TTL and size-bounded LRU eviction.
+
+    Each entry is stored as '<key>.bin' (raw payload) and '<key>.json' (metadata).
+    The payload file modification time is refreshed on every read, and the least
+    recently used entries are evicted once the cache exceeds 'max_bytes'.
+    """
+
+    def __init__(self, cache_dir="~/.cache/api_connect", ttl=86400, max_bytes=512 * 1024 ** 2):
+        """
+
+        Args:
+            cache_dir (str, optional): Cache directory. Defaults to "~/.cache/api_connect".
+            ttl (int, optional): Time to live in seconds. Defaults to 86400 (1 day).
+            max_bytes (int, optional): Maximum total payload size. Defaults to 512MB.
+        """
+        super().__init__(ttl)
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"DiskCache: {self.cache_dir} / TTL: {self.ttl}s / Max bytes: {self.max_bytes}"
+
+    def _paths(self, key):
+        return self.cache_dir / f"{key}.bin", self.cache_dir / f"{key}.json"
+
+    @staticmethod
+    def _atomic_write(path, data):
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        payload_path, meta_path = self._paths(key)
+        try:
+            entry = json.loads(meta_path.read_text())
+            entry["payload"] = payload_path.read_bytes()
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            os.utime(payload_path)  # Mark as recently used.
+        except FileNotFoundError:  # Evicted since the read.
+            pass
+        return entry
+
+    def set(self, key, payload, etag=None, last_modified=None):
+        payload_path, meta_path = self._paths(key)
+        meta = {"etag": etag, "last_modified": last_modified, "fetched_at": time.time()}
+        with self._lock:
+            self._atomic_write(payload_path, payload)
+            self._atomic_write(meta_path, json.dumps(meta).encode())
+            self._evict()
+
+    def touch(self, key):
+        """ Reset the age of an entry after a successful revalidation (304). An
+        entry evicted in the meantime is left out.
+        """
+        payload_path, meta_path = self._paths(key)
+        with self._lock:
+            try:
+                meta = json.loads(meta_path.read_text())
+            except (FileNotFoundError, ValueError):
+                return
+            if not payload_path.exists():
+                return
+            meta["fetched_at"] = time.time()
+            self._atomic_write(meta_path, json.dumps(meta).encode())
+
+    def _evict(self):
+        entries = [(path.stat(), path) for path in self.cache_dir.glob("*.bin")]
+        total = sum(stat.st_size for stat, _ in entries)
+        for stat, path in sorted(entries, key=lambda entry: entry[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+            total -= stat.st_size
+
+    def clear(self):
+        with self._lock:
+            for path in self.cache_dir.glob("*.*"):
+                path.unlink(missing_ok=True)
+
+
+def cached_get(url, params=None, cache=None, source="HTTP", revalidate=False):
+    """ HTTP GET request through the shared transport and an optional response cache.
+
+    Fresh entries are returned without a network call, unless 'revalidate' is
+    set. Stale entries are revalidated with If-None-Match / If-Modified-Since,
+    and a 304 response returns the cached payload.
+
+    Args:
+        url (str): Request URL.
+        params (dict, optional): Query parameters. Defaults to None.
+        cache (BaseCache, optional): Response cache. Defaults to None.
+        source (str, optional): API name used in the cache key. Defaults to "HTTP".
+        revalidate (bool, optional): Send the (conditional) request even if the
+            cached entry is fresh, e.g. to refresh held series. Defaults to False.
+
+    Returns:
+        tuple(int, bytes): Status code, response content.
+    """
+    if cache is None:
+        req = get_transport().get(url, params=params)
+        return req.status_code, req.content
+
+    key = cache.make_key(source, {"url": url, "params": params})
+    entry = cache.get(key)
+    if entry is not None and not revalidate and cache.is_fresh(entry):
+        return 200, entry["payload"]
+
+    headers = cache.validators(entry) if entry is not None else {}
+    req = get_transport().get(url, params=params, headers=headers)
+    if req.status_code == 304 and entry is not None:
+        cache.touch(key)
+        return 200, entry["payload"]
+    if req.status_code == 200:
+        cache.set(
+            key,
+            req.content,
+            etag=req.headers.get("ETag"),
+            last_modified=req.headers.get("Last-Modified"),
+        )
+    return req.status_code, req.content
+
+
+# %%
@@ -3,37 +3,398 @@
 from api_connect.ons_api import OnsApi
 from api_connect.boe_api import BoeApi
 from api_connect.hmlr_api import HmlrApi
+from api_connect.frequency import convert_frequency, period_end, set_date_freq
+from api_connect.history import REPORT_COLUMNS
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import pandas as pd
 
 class DataBank:
-    def __init__(self):
+    def __init__(self, max_workers=8, source_limits=None, cache=None, store=None):
+        """
+
+        Args:
+            max_workers (int, optional): Maximum number of concurrent requests
+                across all APIs. Defaults to 8.
+            source_limits (dict, optional): Maximum number of concurrent requests
+                per API name, e.g. {"ONS": 4}. APIs not listed are only bounded
+                by max_workers. Defaults to None.
+            cache (BaseCache, optional): Response cache shared by all API objects,
+                see api_connect.cache. Defaults to None.
+            store (SeriesStore, optional): Local store of raw series, see
+                api_connect.store. Stored series are served without a request and
+                newly retrieved series are written back. Defaults to None.
+        """
         self.registered_apis = {"ONS": OnsApi,
                                 "BOE": BoeApi,
                                 "HMLR": HmlrApi}
         self.data_log = []
-        
+        self.errors = []
+        self.series = {}  # Raw, native-frequency API objects per unique series.
+        self._views = {}  # Memoised (series, frequency, interpolation) views and their logs.
+        self.cache = cache
+        self.store = store
+        self._unsaved = set()  # Series keys retrieved since the last store write.
+        self.max_workers = max_workers
+        self.source_limits = {"ONS": 4, "BOE": 4, "HMLR": 2}
+        if source_limits is not None:
+            self.source_limits.update(source_limits)
+
     def __repr__(self):
         return str(self.registered_apis)
-    
+
     def register_api(self, api_name, api_obj):
         self.registered_apis[api_name] = api_obj
-    
+
     @staticmethod
     def _check_date_interval(date_interval):
         if date_interval not in ["m", "q", "y"]:
             raise ValueError("Date interval input should be: m / q / y.")
-        
-    def retrieve_data(self, api_name, api_params, date_interval):
+
+    def _check_api_name(self, api_name):
+        if api_name not in self.registered_apis:
+            raise KeyError(f"API is not registered: {api_name}.")
+
+    @staticmethod
+    def _series_key(api_name, params):
+        return (api_name, tuple(sorted(params.items())))
+
+    def _make_api(self, api_name, params):
+        if self.cache is not None:
+            params = {"cache": self.cache, **params}
+        return self.registered_apis[api_name](**params)
+
+    def _source_pools(self, api_names, max_workers):
+        return {
+            api_name: ThreadPoolExecutor(
+                max_workers=min(self.source_limits.get(api_name, max_workers), max_workers)
+            )
+            for api_name in dict.fromkeys(api_names)
+        }
+
+    def plan(self, requests):
+        """ Plan the retrieval of a set of requests without any I/O.
+
+        Requests are deduplicated, series already held are dropped and the rest
+        are grouped per API, so that each group can be batched.
+
+        Args:
+            requests (list): List of (API name, API input parameters) tuples.
+
+        Returns:
+            dict: {API name: {series key: API input parameters}} to retrieve.
+        """
+        plan = {}
+        for api_name, params in requests:
+            self._check_api_name(api_name)
+            key = self._series_key(api_name, params)
+            if key not in self.series:
+                plan.setdefault(api_name, {})[key] = params
+        return plan
+
+    def execute(self, plan, max_workers=None):
+        """ Execute a retrieval plan.
+
+        API groups run concurrently. Within a group, series are first resolved
+        through the API 'batch' classmethod where available, and the rest are
+        fetched one by one in the API worker pool bounded by 'source_limits'. The
+        total number of requests in flight is bounded by 'max_workers'.
+
+        Args:
+            plan (dict): Retrieval plan, see 'plan'.
+            max_workers (int, optional): Overrides 'max_workers'. Defaults to None.
+
+        Returns:
+            dict: Error per series key that could not be retrieved.
+        """
+        if not plan:
+            return {}
+        max_workers = max_workers or self.max_workers
+        in_flight = threading.BoundedSemaphore(max_workers)
+        pools = self._source_pools(plan, max_workers)
+
+        def fetch(api_name, params):
+            with in_flight:
+                _api_obj = self._make_api(api_name, params)
+                if hasattr(_api_obj, "fetch"):  # Registered APIs may fetch eagerly.
+                    _api_obj.fetch()
+                return _api_obj
+
+        def run_group(api_name, group):
+            pending = dict(group)
+            api_cls = self.registered_apis[api_name]
+            if hasattr(api_cls, "batch"):
+                kwargs = {"cache": self.cache} if self.cache is not None else {}
+                try:
+                    with in_flight:
+                        apis = api_cls.batch(list(group.values()), **kwargs)
+                except Exception:
+                    apis = []  # Fall back to per-series requests.
+                for key, _api_obj in zip(group, apis):
+                    if _api_obj is not None:
+                        self.series[key] = _api_obj
+                        self._unsaved.add(key)
+                        del pending[key]
+
+            futures = {
+                key: pools[api_name].submit(fetch, api_name, params)
+                for key, params in pending.items()
+            }
+            errors = {}
+            for key, future in futures.items():
+                try:
+                    self.series[key] = future.result()
+                    self._unsaved.add(key)
+                except Exception as err:
+                    errors[key] = err
+            return errors
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(plan)) as group_pool:
+                futures = [
+                    group_pool.submit(run_group, api_name, group)
+                    for api_name, group in plan.items()
+                ]
+            errors = {}
+            for future in futures:
+                errors.update(future.result())
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+        return errors
+
+    def _load_stored(self, requests):
+        """ Create API objects from the store for series not yet held.
+        """
+        if self.store is None:
+            return
+        params = {}
+        for api_name, _params in requests:
+            self._check_api_name(api_name)
+            key = self._series_key(api_name, _params)
+            if key not in self.series and hasattr(self.registered_apis[api_name], "from_raw_series"):
+                params[key] = _params
+        kwargs = {"cache": self.cache} if self.cache is not None else {}
+        for key, raw_series in self.store.load(list(params)).items():
+            self.series[key] = self.registered_apis[key[0]].from_raw_series(
+                params[key], raw_series, **kwargs
+            )
+
+    def save_stored(self):
+        """ Write the series retrieved since the last write to the store.
+        """
+        if self.store is None or not self._unsaved:
+            return
+        keys, self._unsaved = self._unsaved, set()
+        self.store.save({key: self.series[key].get_raw_series() for key in keys})
+
+    def _compute_views(self, keys, date_interval, method):
+        """ Derive the missing frequency views of many series in one pass.
+
+        The native series are aligned into one frame and converted together,
+        see api_connect.frequency.convert_frequency, then split back into
+        memoised per-series views, each over its own date range. Series whose
+        API does not expose 'get_native_series', or which fail to load, are left
+        to '_retrieve'.
+        """
+        natives = {}
+        for key in dict.fromkeys(keys):
+            _api_obj = self.series.get(key)
+            if (key, date_interval, method) in self._views or not hasattr(
+                _api_obj, "get_native_series"
+            ):
+                continue
+            try:
+                natives[key] = _api_obj.get_native_series(date_interval)
+            except Exception:
+                continue
+        if not natives:
+            return
+        keys, natives = list(natives), list(natives.values())
+
+        # Positional column names, as series from different APIs may share a name.
+        converted, interpolated = convert_frequency(
+            pd.concat([df.iloc[:, 0].rename(i) for i, df in enumerate(natives)], axis=1),
+            date_interval,
+            method,
+            [df.attrs.get("date_freq") for df in natives],
+        )
+        for i, key in enumerate(keys):
+            start = period_end(natives[i].index.min(), date_interval)
+            end = period_end(natives[i].index.max(), date_interval)
+            df = set_date_freq(converted.loc[start:end, [i]], date_interval)
+            df.columns = natives[i].columns[:1]
+            _api_obj = self.series[key]
+            _api_obj.date_freq = date_interval
+            _api_obj.interporlated = method if interpolated.loc[start:end, i].any() else None
+            self._views[(key, date_interval, method)] = (df, repr(_api_obj))
+
+    def _retrieve(self, api_name, params, date_interval, method):
+        """ Retrieve a frequency view of a series.
+
+        The API object holding the raw, native-frequency content is created once
+        per unique series, and each (series, frequency, interpolation) view is
+        derived from it once and memoised, together with the API log at the time,
+        since the shared API object only describes the last view derived.
+
+        Returns:
+            tuple(pandas.DataFrame, str): Time-series dataframe, API log.
+        """
+        key = self._series_key(api_name, params)
+        if key not in self.series:
+            self.series[key] = self._make_api(api_name, params)
+            self._unsaved.add(key)
+        _api_obj = self.series[key]
+        view_key = (key, date_interval, method)
+        if view_key not in self._views:
+            self._views[view_key] = (_api_obj.get_time_series(date_interval, method), repr(_api_obj))
+        return self._views[view_key]
+
+    def retrieve_data(self, api_name, api_params, date_interval, concurrent=False, method="spline"):
+        """ Retrieve time-series from a registered API.
+
+        Args:
+            api_name (str): Registered API name, e.g. ONS / BOE / HMLR.
+            api_params (list): List of API input parameters.
+            date_interval (str): m / q / y
+            concurrent (bool, optional): Fetch the series concurrently and collect
+                errors in 'errors' instead of raising. Defaults to False.
+            method (str, optional): Interpolation method. Defaults to "spline".
+
+        Returns:
+            pandas.DataFrame: Time-series dataframe.
+        """
+        requests = [(api_name, params) for params in api_params]
+        if concurrent:
+            return self.retrieve_many(requests, date_interval, method=method)
+
         self._check_date_interval(date_interval)
+        self._load_stored(requests)
+        errors = self.execute(self.plan(requests), max_workers=1)
+        self._compute_views(
+            [self._series_key(api_name, params) for params in api_params], date_interval, method
+        )
         dfs = []
-        api_obj = self.registered_apis[api_name]
         for params in api_params:
-            _api_obj = api_obj(**params)
-            dfs.append(_api_obj.get_time_series(date_interval))
-            self.data_log.append(repr(_api_obj))
-        return pd.concat(dfs, axis=1)
-    
+            key = self._series_key(api_name, params)
+            if key in errors:
+                raise errors[key]
+            df, log = self._retrieve(api_name, params, date_interval, method)
+            dfs.append(df)
+            self.data_log.append(log)
+        self.save_stored()
+        return set_date_freq(pd.concat(dfs, axis=1), date_interval)
+
+    def retrieve_many(self, requests, date_interval, max_workers=None, method="spline"):
+        """ Concurrently retrieve time-series from one or more registered APIs.
+
+        The requests are planned (deduplicated and grouped per API) before any
+        I/O, and the plan is executed concurrently, see 'plan' and 'execute'. A
+        failing series does not abort the batch; the error is appended to
+        'errors' instead.
+
+        Args:
+            requests (list): List of (API name, API input parameters) tuples.
+            date_interval (str): m / q / y
+            max_workers (int, optional): Overrides 'max_workers' for this call.
+                Defaults to None.
+            method (str, optional): Interpolation method. Defaults to "spline".
+
+        Returns:
+            pandas.DataFrame: Time-series dataframe, columns in the order of requests.
+        """
+        self._check_date_interval(date_interval)
+        self._load_stored(requests)
+        errors = self.execute(self.plan(requests), max_workers)
+        self._compute_views(
+            [self._series_key(api_name, params) for api_name, params in requests],
+            date_interval,
+            method,
+        )
+
+        dfs = []
+        for api_name, params in requests:
+            key = self._series_key(api_name, params)
+            try:
+                if key in errors:
+                    raise errors[key]
+                df, log = self._retrieve(api_name, params, date_interval, method)
+            except Exception as err:
+                self.errors.append({"API": api_name, "Parameters": params, "Error": err})
+                continue
+            dfs.append(df)
+            self.data_log.append(log)
+
+        self.save_stored()
+        return set_date_freq(pd.concat(dfs, axis=1) if dfs else pd.DataFrame(), date_interval)
+
+    def update_data(self, api_name=None, overlap=3):
+        """ Incrementally refresh the held series.
+
+        Each API object retrieves only the observations after its last held date,
+        less an overlap window to pick up revisions, where the source allows it.
+        Memoised views of series whose held data changed are dropped and derived
+        again on demand, and the series are written back to the store.
+
+        Args:
+            api_name (str, optional): Refresh only this API. Defaults to None, all.
+            overlap (int, optional): Overlap window in months. Defaults to 3.
+
+        Returns:
+            pandas.DataFrame: Added / revised points per series.
+        """
+        keys = [key for key in self.series if api_name in (None, key[0])]
+        pools = self._source_pools([key[0] for key in keys], self.max_workers)
+
+        def refresh(_api_obj):
+            if not hasattr(_api_obj, "get_raw_series"):
+                report = _api_obj.update(overlap)
+                return report, not report.empty
+            held = _api_obj.get_raw_series()
+            report = _api_obj.update(overlap)
+            latest = _api_obj.get_raw_series()
+            changed = held.keys() != latest.keys() or any(
+                not held[freq].equals(latest[freq]) for freq in held
+            )
+            return report, changed
+
+        try:
+            futures = {
+                key: pools[key[0]].submit(refresh, self.series[key]) for key in keys
+            }
+            reports = []
+            for key, future in futures.items():
+                try:
+                    report, changed = future.result()
+                except Exception as err:
+                    self.errors.append({"API": key[0], "Parameters": dict(key[1]), "Error": err})
+                    continue
+                self.data_log.append(repr(self.series[key]))
+                if changed:
+                    self._views = {
+                        view_key: view
+                        for view_key, view in self._views.items()
+                        if view_key[0] != key
+                    }
+                    self._unsaved.add(key)
+                if not report.empty:
+                    reports.append(report.assign(API=key[0], Parameters=str(dict(key[1]))))
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+
+        self.save_stored()
+
+        if not reports:
+            return pd.DataFrame(columns=["API", "Parameters", *REPORT_COLUMNS])
+        return pd.concat(reports, ignore_index=True)[["API", "Parameters", *REPORT_COLUMNS]]
+
     def reset_log(self):
         self.data_log = []
-    
+        self.errors = []
+
+    def reset_series(self):
+        self.series = {}
+        self._views = {}
+
 # %%
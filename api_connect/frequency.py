@@ -0,0 +1,204 @@
+#%%
+import numpy as np
+import pandas as pd
+from scipy.interpolate import make_interp_spline
+
+N_MONTH = {"y": 1, "q": 4, "m": 12}
+# Base of pandas offset rule codes, before any anchor, e.g. M / BM / Q-DEC / A-DEC.
+PANDAS_FREQ = {
+    **dict.fromkeys(["M", "MS", "BM", "BMS"], "m"),
+    **dict.fromkeys(["Q", "QS", "BQ", "BQS"], "q"),
+    **dict.fromkeys(["A", "AS", "BA", "BAS", "Y", "YS", "BY", "BYS"], "y"),
+    **dict.fromkeys(["D", "B", "C"], "d"),
+}
+
+
+def set_date_freq(df, date_freq):
+    """ Attach the date frequency to a time-series dataframe, see get_date_freq.
+
+    Args:
+        df (pandas.DataFrame, pandas.Series): Time-series.
+        date_freq (str): m / q / y (d for daily series).
+
+    Returns:
+        pandas.DataFrame, pandas.Series: The same time-series.
+    """
+    df.attrs["date_freq"] = date_freq
+    return df
+
+
+def _pandas_freq(rule_code):
+    return PANDAS_FREQ.get(rule_code.split("-")[0])
+
+
+def _matches_freq(index, date_freq):
+    """ O(1) check that a sorted date index spans exactly one period per
+    observation.
+
+    pandas keeps 'attrs' through resampling and slicing, so an attached frequency
+    may be stale; e.g. monthly metadata on a quarterly resampled frame spans three
+    periods per observation and is rejected. An index with interior gaps is
+    rejected too, as shifting it by n positions is not a shift by n periods.
+    """
+    if date_freq not in N_MONTH:
+        return True
+    n_obs = len(index)
+    if n_obs < 2:
+        return True
+    span = pd.Period(index[-1], date_freq).ordinal - pd.Period(index[0], date_freq).ordinal
+    return span == n_obs - 1
+
+
+def get_date_freq(data, infer=True):
+    """ Date frequency of a time-series.
+
+    Read from, in order: the frequency of a PeriodIndex / DatetimeIndex, the
+    frequency attached by api_connect (see set_date_freq), and, for foreign data,
+    pandas frequency inference.
+
+    Args:
+        data (pandas.DataFrame, pandas.Series): Time-series.
+        infer (bool, optional): Infer the frequency from the dates if there is no
+            metadata. Defaults to True.
+
+    Returns:
+        str: m / q / y (d for daily series), None if unknown.
+    """
+    index = getattr(data, "index", None)
+    offset = getattr(index, "freq", None)
+    if offset is not None and offset.n == 1:
+        return _pandas_freq(offset.rule_code)
+
+    date_freq = getattr(data, "attrs", {}).get("date_freq")
+    if date_freq is not None and isinstance(index, pd.DatetimeIndex) and _matches_freq(index, date_freq):
+        return date_freq
+
+    if infer and isinstance(index, pd.DatetimeIndex) and len(index) >= 3:
+        freq = pd.infer_freq(index)
+        if freq is not None and not freq[0].isdigit():
+            return _pandas_freq(freq)
+    return None
+
+
+def identify_freq(index):
+    """ Identify the date frequency of a time-series index.
+
+    Args:
+        index (pandas.DatetimeIndex): Dates of the observations.
+
+    Returns:
+        tuple(int, str): # of unique months, date frequency (None if not m / q / y).
+    """
+    n_month = index.month.nunique()
+    freq = {1: "y", 4: "q", 12: "m"}
+    return (n_month, freq.get(n_month))
+
+
+def period_end(date, date_freq):
+    """ Label of the m / q / y resampling bin containing a date.
+    """
+    return pd.Period(date, date_freq).end_time.normalize()
+
+
+def _fill(values, x, mask, method):
+    """ Interpolate the interior gaps of columns sharing one observation mask.
+
+    Args:
+        values (numpy.ndarray): (n dates, n columns) values on the target grid.
+        x (numpy.ndarray): Grid abscissae.
+        mask (numpy.ndarray): Observed points of the group, shared by all columns.
+        method (str): spline / linear.
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray): Gap positions, interpolated values.
+    """
+    observed = np.flatnonzero(mask)
+    gaps = np.arange(observed[0], observed[-1] + 1)
+    gaps = gaps[~mask[gaps]]
+    if not len(gaps) or len(observed) < 2:
+        return gaps[:0], values[gaps[:0]]
+
+    x_obs, y_obs = x[observed], values[observed]
+    if method == "spline":
+        # Interpolating cubic spline with not-a-knot ends, as scipy UnivariateSpline
+        # with s=0, fitted for all columns of the group at once.
+        spline = make_interp_spline(x_obs, y_obs, k=min(3, len(observed) - 1))
+        return gaps, spline(x[gaps])
+
+    # Linear interpolation of all columns at once.
+    right = np.searchsorted(x_obs, x[gaps])
+    weight = ((x[gaps] - x_obs[right - 1]) / (x_obs[right] - x_obs[right - 1]))[:, None]
+    return gaps, y_obs[right - 1] * (1 - weight) + y_obs[right] * weight
+
+
+def convert_frequency(df, date_freq, method="spline", native_freqs=None):
+    """ Convert an aligned multi-column time-series dataframe to m / q / y.
+
+    All columns are resampled to the target grid in one pass. Columns observed at a
+    coarser frequency than the target are interpolated inside their own valid
+    range. Columns are grouped by their observation mask, so one spline is fitted
+    per group for all of its columns rather than one per column.
+
+    Args:
+        df (pandas.DataFrame): Date-indexed time-series dataframe.
+        date_freq (str): Target frequency, m / q / y.
+        method (str, optional): Interpolation method: spline (cubic) / linear, or
+            any pandas interpolation method. Defaults to "spline".
+        native_freqs (list, optional): Native frequency (m / q / y / d) per column,
+            identified from the observations where None. Defaults to None.
+
+    Returns:
+        tuple(pandas.DataFrame, pandas.DataFrame): Converted dataframe, boolean
+            dataframe flagging the interpolated points.
+    """
+    output = set_date_freq(df.resample(date_freq).asfreq(), date_freq)
+    interpolated = pd.DataFrame(False, index=output.index, columns=output.columns)
+    observed = output.notna().to_numpy()
+
+    native_freqs = native_freqs or [None] * df.shape[1]
+    coarse = [
+        i
+        for i, native_freq in enumerate(native_freqs)
+        if (
+            N_MONTH.get(native_freq, 12)
+            if native_freq is not None
+            else identify_freq(df.index[df.iloc[:, i].notna()])[0]
+        )
+        < N_MONTH[date_freq]
+    ]
+    if not coarse:
+        return output, interpolated
+
+    values = output.to_numpy(dtype=float, copy=True)
+    flags = interpolated.to_numpy(copy=True)
+    if method in ["spline", "linear"]:
+        # pandas 'linear' treats the values as equally spaced, 'spline' uses the dates.
+        x = (
+            np.arange(len(output), dtype=float)
+            if method == "linear"
+            else output.index.to_numpy(dtype="datetime64[D]").astype(float)
+        )
+        groups = {}
+        for i in coarse:
+            groups.setdefault(observed[:, i].tobytes(), []).append(i)
+        for cols in groups.values():
+            mask = observed[:, cols[0]]
+            if not mask.any():
+                continue
+            gaps, filled = _fill(values[:, cols], x, mask, method)
+            values[np.ix_(gaps, cols)] = filled
+            flags[np.ix_(gaps, cols)] = True
+    else:
+        cols = output.columns[coarse]
+        filled = output[cols].interpolate(method=method, limit_area="inside")
+        values[:, coarse] = filled.to_numpy()
+        flags[:, coarse] = filled.notna().to_numpy() & ~observed[:, coarse]
+
+    output = set_date_freq(
+        pd.DataFrame(values, index=output.index, columns=output.columns), date_freq
+    )
+    interpolated = pd.DataFrame(flags, index=output.index, columns=output.columns)
+    return output, interpolated
+
+
+# %%
@@ -0,0 +1,47 @@
+#%%
+import numpy as np
+import pandas as pd
+
+REPORT_COLUMNS = ["Series", "DATE", "Previous", "Latest", "Status"]
+
+
+def merge_history(old, new, rtol=0.0, atol=0.0):
+    """ Merge newly retrieved observations into the held time-series.
+
+    Observations in 'new' take precedence, so revised points replace the held
+    values and points after the last held date are appended. Points are
+    reported as revised when they differ beyond the tolerances, exactly by
+    default; the merged values are the new ones either way.
+
+    Args:
+        old (pandas.DataFrame): Held single column time-series dataframe.
+        new (pandas.DataFrame): Newly retrieved time-series dataframe.
+        rtol (float, optional): Relative tolerance of a revision. Defaults to 0.
+        atol (float, optional): Absolute tolerance of a revision. Defaults to 0.
+
+    Returns:
+        tuple(pandas.DataFrame, pandas.DataFrame): Merged time-series dataframe,
+            report of the added / revised points.
+    """
+    old_ts = old.iloc[:, 0].dropna()
+    new_ts = new.iloc[:, 0].dropna()
+    merged = new.combine_first(old)[old.columns]
+
+    common = new_ts.index.intersection(old_ts.index)
+    revised = common[~np.isclose(old_ts[common], new_ts[common], rtol=rtol, atol=atol)]
+    added = new_ts.index.difference(old_ts.index)
+
+    report = pd.DataFrame(
+        {
+            "Series": old.columns[0],
+            "DATE": revised.append(added),
+            "Previous": old_ts.reindex(revised.append(added)).to_numpy(),
+            "Latest": new_ts.reindex(revised.append(added)).to_numpy(),
+            "Status": ["revised"] * len(revised) + ["added"] * len(added),
+        },
+        columns=REPORT_COLUMNS,
+    )
+    return merged, report.sort_values("DATE", ignore_index=True)
+
+
+# %%
@@ -1,7 +1,10 @@
 #%%
-from SPARQLWrapper import SPARQLWrapper, JSON
+import json
 from pandas.tseries.offsets import MonthEnd
 import pandas as pd
+from api_connect.frequency import convert_frequency, set_date_freq
+from api_connect.history import merge_history
+from api_connect.transport import get_transport
 
 
 class HmlrApi:
@@ -13,129 +16,248 @@ class HmlrApi:
         please refer to the website: https://landregistry.data.gov.uk/app/ukhpi.
     """
 
-    def __init__(self, query_var, region="united-kingdom"):
+    endpoint = "http://landregistry.data.gov.uk/landregistry/query"
+    region_uri = "http://landregistry.data.gov.uk/id/region/"
+
+    def __init__(self, query_var, region="united-kingdom", cache=None, ts_df=None):
+        """
+
+        Args:
+            query_var (str): UKHPI property, e.g. housePriceIndex.
+            region (str, optional): UKHPI region. Defaults to "united-kingdom".
+            cache (BaseCache, optional): Response cache. Defaults to None.
+            ts_df (pandas.DataFrame, optional): Already retrieved time-series, e.g.
+                from HmlrApi.batch. No query is issued if given. Defaults to None.
+
+        No query is issued on creation; the content is retrieved when the data is
+        first needed, or when 'fetch' is called.
+        """
 
         self.query_var = query_var
         self.region = region
-        self.endpoint = "http://landregistry.data.gov.uk/landregistry/query"
         self.date_freq = None
         self.interporlated = None
-        self._get_content()
+        self.cache = cache
+        self._df = ts_df
+        self._content = None  # Retrieved on first access, see fetch.
 
     def __repr__(self):
         api = "HMLR"
         query_var = f"Query Variable: {self.query_var}"
+        region = f"Region: {self.region}"
         date_freq = f"Date Frequency: {self.date_freq}"
         interporlated = f"Interpolation: {self.interporlated}"
-        return " / ".join([api, query_var, date_freq, interporlated])
+        return " / ".join([api, query_var, region, date_freq, interporlated])
 
-    def _get_query(self):
-        """ SPARQL Query.
-        TODO: SQL expert needed!!
+    @property
+    def content(self):
+        """ Raw response content, retrieved on first access.
         """
-        self.query = (
-            """
+        if self._content is None:
+            self._get_content()
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+
+    @property
+    def is_fetched(self):
+        return self._df is not None or self._content is not None
+
+    def fetch(self):
+        """ Retrieve the content now, unless the time-series is already held.
+
+        Returns:
+            HmlrApi: self
+        """
+        if not self.is_fetched:
+            self._get_content()
+        return self
+
+    @classmethod
+    def _build_query(cls, query_vars, regions, start_date=None):
+        """ SPARQL Query selecting several UKHPI properties for several regions.
+
+        Args:
+            query_vars (list): UKHPI properties.
+            regions (list): UKHPI regions.
+            start_date (pandas.Timestamp, optional): First month to select.
+                Defaults to None, all months.
+
+        Returns:
+            str: SPARQL query.
+        """
+        region_values = " ".join(f"<{cls.region_uri}{region}>" for region in regions)
+        select_vars = " ".join(f"?{var}" for var in query_vars)
+        optionals = "\n".join(
+            f"            OPTIONAL {{ ?item  ukhpi:{var}  ?{var} }}" for var in query_vars
+        )
+        if start_date is not None:
+            optionals += f'\n            FILTER ( STR(?DATE) >= "{start_date:%Y-%m}" )'
+        return f"""
         PREFIX  xsd:  <http://www.w3.org/2001/XMLSchema#>
         PREFIX  ukhpi: <http://landregistry.data.gov.uk/def/ukhpi/>
 
-        SELECT  *
+        SELECT  ?DATE ?Region {select_vars}
         WHERE
-          { { SELECT  ?DATE ?item
-              WHERE
-                { ?item  ukhpi:refRegion  <http://landregistry.data.gov.uk/id/region/"""
-            + f"{self.region}"
-            + """> ;
-                         ukhpi:refMonth   ?DATE
-                }
-              ORDER BY ?DATE
-            }
-            OPTIONAL
-              { ?item  ukhpi:"""
-            + f"{self.query_var}  ?{self.query_var}"
-            + """ }
-
-            BIND(<http://landregistry.data.gov.uk/id/region/"""
-            + f"{self.region}"
-            + """> AS ?Region)
-          }
+          {{ VALUES ?Region {{ {region_values} }}
+            ?item  ukhpi:refRegion  ?Region ;
+                   ukhpi:refMonth   ?DATE .
+{optionals}
+          }}
+        ORDER BY ?DATE
         """
-        )
+
+    def _get_query(self):
+        """ SPARQL Query.
+        """
+        self.query = self._build_query([self.query_var], [self.region])
         return self.query
 
+    @classmethod
+    def _request(cls, query, cache=None, revalidate=False):
+        """ Run the SPARQL query. SPARQL results are cached on TTL only,
+        as the endpoint does not issue validators for query results; with
+        'revalidate', the query is always sent and the cached entry replaced.
+        """
+        if cache is not None:
+            key = cache.make_key("HMLR", {"url": cls.endpoint, "query": query})
+            entry = cache.get(key) if not revalidate else None
+            if entry is not None and cache.is_fresh(entry):
+                return json.loads(entry["payload"])
+
+        # SPARQL protocol query via POST, as multi-region queries are long.
+        response = get_transport().post(
+            cls.endpoint,
+            data={"query": query},
+            headers={"Accept": "application/sparql-results+json"},
+        )
+        if response.status_code != 200:
+            raise ConnectionError(f"A {response.status_code} was issued for the SPARQL query.")
+        if cache is not None:
+            cache.set(key, response.content)
+        return json.loads(response.content)
+
     def _get_content(self):
-        self.query = self._get_query()
-        self.response = SPARQLWrapper(self.endpoint)
-        self.response.setQuery(self.query)
-        self.response.setReturnFormat(JSON)
-        self.response = self.response.query()
-        self.content = self.response.convert()
-
-    @staticmethod
-    def catch(func, *args, **kwargs):
-        try:
-            return func(*args, **kwargs)
-        except TypeError:
-            return None
-
-    @staticmethod
-    def _freq_to_n_month(date_freq, shift=0):
-        """ 
+        self.content = self._request(self._get_query(), self.cache)
+
+    @classmethod
+    def _parse_content(cls, content):
+        """ Load SPARQL JSON results to a typed Pandas DataFrame.
+
+        Bindings are read column by column and converted with vectorised
+        pandas parsers: DATE to month-end timestamps, Region to the region name
+        and every other variable to float. A query without results, e.g. an
+        unknown region or property, gives an empty frame with the same columns.
 
         Args:
-            date_freq (str): date frequency, m / q / y.
-            n (int, optional): Index shift to an alternative frequency. Defaults to 0.
+            content (dict): SPARQL JSON results.
 
         Returns:
-            str: ONS frequency.
+            pd.DataFrame: Long dataframe with DATE, Region and one column per variable.
         """
-        freq = {"y": 1, "q": 4, "m": 12}
-        freq_index = list(freq).index(date_freq)
-        return list(freq.values())[freq_index + shift]
+        bindings = content["results"]["bindings"]
+        if not bindings:
+            value_vars = [var for var in content["head"]["vars"] if var not in ["DATE", "Region"]]
+            return pd.DataFrame(
+                {
+                    "DATE": pd.DatetimeIndex([]),
+                    "Region": pd.Series(dtype=object),
+                    **{var: pd.Series(dtype=float) for var in value_vars},
+                }
+            )[content["head"]["vars"]]
+        df = pd.DataFrame(
+            {
+                var: [row[var]["value"] if var in row else None for row in bindings]
+                for var in content["head"]["vars"]
+            }
+        )
+        df["DATE"] = pd.to_datetime(df["DATE"], format="%Y-%m") + MonthEnd(1)
+        df["Region"] = df["Region"].str.replace(cls.region_uri, "", regex=False)
+        value_vars = df.columns.difference(["DATE", "Region"])
+        df[value_vars] = df[value_vars].apply(pd.to_numeric, errors="coerce").astype(float)
+        return df
 
-    def _freq_identify(self, df):
-        """ Identify the date frequency of the time-series dataframe.
+    @classmethod
+    def batch(cls, api_params, cache=None):
+        """ Retrieve many (query_var, region) series with a single SPARQL query.
 
         Args:
-            df (pandas.DataFrame): Time-series dataframe.
+            api_params (list): List of HmlrApi input parameters.
+            cache (BaseCache, optional): Response cache. Defaults to None.
+
+        Returns:
+            list: HmlrApi objects in the order of api_params, None for series
+                without any observation.
+        """
+        api_params = [{"region": "united-kingdom", **params} for params in api_params]
+        query_vars = list(dict.fromkeys(params["query_var"] for params in api_params))
+        regions = list(dict.fromkeys(params["region"] for params in api_params))
+        df = cls._parse_content(cls._request(cls._build_query(query_vars, regions), cache))
+        region_dfs = {region: _df.set_index("DATE") for region, _df in df.groupby("Region")}
+
+        apis = []
+        for params in api_params:
+            _df = region_dfs.get(params["region"])
+            if _df is None or _df[params["query_var"]].isna().all():
+                apis.append(None)
+                continue
+            apis.append(cls(**params, cache=cache, ts_df=_df[[params["query_var"]]]))
+        return apis
+
+    def _ts_df(self):
+        """ Load SPARQL queried data to Padnas DataFrame.
 
         Returns:
-            tuple(int, str): # of unique months, date frequency.
+            pd.DataFrame: Time-series data.
         """
-        n_month = df.index.month.nunique()
-        freq = {1: "y", 4: "q", 12: "m"}
-        return (n_month, freq.get(n_month))
+        if self._df is None:
+            df = self._parse_content(self.content).set_index("DATE")
+            if df[self.query_var].isna().all():
+                raise ValueError(f"No HMLR observation for {self.query_var} in region {self.region}.")
+            self._df = df[[self.query_var]]
+        return self._df
+
+    def get_raw_series(self):
+        """ Retrieve the held time-series at its native (monthly) frequency.
+
+        Returns:
+            dict: Time-series dataframe per frequency.
+        """
+        return {"m": self._ts_df()}
+
+    @classmethod
+    def from_raw_series(cls, api_params, raw_series, cache=None):
+        return cls(**api_params, cache=cache, ts_df=raw_series["m"])
 
-    def _interporlate_ts(self, df, date_freq):
-        """ Interpolate Time-series (date-indexed) dataframe.
+    def update(self, overlap=3):
+        """ Retrieve observations from the last held month, less an overlap window
+        to pick up revisions, and merge them into the held time-series. The
+        query bypasses the cache TTL.
 
         Args:
-            df (pandas.DataFrame): Time-series dataframe.
-            date_freq (str): Resampling frequency (m/q/y)
+            overlap (int, optional): Overlap window in months. Defaults to 3.
 
         Returns:
-            pd.DataFrame: Interporlated time-series dataframe.
+            pandas.DataFrame: Added / revised points.
         """
-        self.interporlated = True
-        return df.resample(date_freq).interpolate(method="spline", order=3, s=0.0)
+        df = self._ts_df()
+        start_date = df.index.max() - pd.DateOffset(months=overlap)
+        query = self._build_query([self.query_var], [self.region], start_date)
+        new_df = self._parse_content(self._request(query, self.cache, revalidate=True)).set_index("DATE")
+        self._df, report = merge_history(df, new_df[[self.query_var]])
+        return report
 
-    def _ts_df(self):
-        """ Load SPARQL queried data to Padnas DataFrame.
+    def get_native_series(self, date_freq=None):
+        """ Retrieve the held time-series at its native (monthly) frequency.
 
         Returns:
-            pd.DataFrame: Time-series data.
+            pandas.DataFrame: Time-series dataframe.
         """
-        df = []
-        col_vars = self.content["head"]["vars"]
-        for row in self.content["results"]["bindings"]:
-            df.append([self.catch(lambda: row.get(key)["value"]) for key in col_vars])
-
-        df = pd.DataFrame(df, columns=col_vars)
-        df["DATE"] = pd.to_datetime(df.iloc[:, 0]) + MonthEnd(1)
-        df = df.set_index("DATE")
-        df[self.query_var] = df[self.query_var].astype(float)
-        return df[[self.query_var]]
-
-    def get_time_series(self, date_freq):
+        return set_date_freq(self._ts_df(), "m")
+
+    def get_time_series(self, date_freq, method="spline"):
         """ Retrieve time-series dataframe based on input date frequency.
         
         If date frequency input is more granular than the available date frequency, 
@@ -143,22 +265,15 @@ class HmlrApi:
 
         Args:
             date_freq (str): m / q / y
+            method (str, optional): Interpolation method. Defaults to "spline".
 
         Returns:
             pandas.DataFrame: Time-series dataframe.
         """
         self.date_freq = date_freq
-        df = self._ts_df()
-        n_month, freq = self._freq_identify(df)
-        target_n_month = self._freq_to_n_month(date_freq)
-        if target_n_month > n_month: # Interporlation required.
-            df = df.resample(date_freq).asfreq()
-            # Last index with non NaN entry.
-            valid_loc = df.index.get_loc(df.iloc[:, 0].last_valid_index())
-            df = df.iloc[: valid_loc + 1, :]  # Exclude last NaN row.
-            return self._interporlate_ts(df, date_freq)
-        else:
-            return df.resample(date_freq).asfreq()
+        df, interpolated = convert_frequency(self.get_native_series(), date_freq, method, ["m"])
+        self.interporlated = method if interpolated.values.any() else None
+        return df
 
 
 # %%
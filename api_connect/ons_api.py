@@ -1,16 +1,39 @@
 #%%
+import json
 import pandas as pd
-import requests
+from pandas.tseries.offsets import MonthEnd, YearEnd
+from api_connect.cache import cached_get
+from api_connect.frequency import convert_frequency, set_date_freq
+from api_connect.history import merge_history, REPORT_COLUMNS
 
 
 class OnsApi:
-    def __init__(self, dataset_id, timeseries_id):
+    endpoint = "https://api.ons.gov.uk/timeseries"
+
+    def __init__(self, dataset_id, timeseries_id, cache=None, ts_dfs=None):
+        """
+
+        Args:
+            dataset_id (str): ONS dataset ID.
+            timeseries_id (str): ONS timeseries ID.
+            cache (BaseCache, optional): Response cache. Defaults to None.
+            ts_dfs (dict, optional): Already retrieved time-series per ONS frequency
+                (months / quarters / years), e.g. from a SeriesStore. No request is
+                issued if given. Defaults to None.
+
+        No request is issued on creation; the content is retrieved when the data is
+        first needed, or when 'fetch' is called.
+        """
         self.timeseries_id = timeseries_id
         self.dataset_id = dataset_id
-        self.endpoint = "https://api.ons.gov.uk/timeseries"
         self.date_freq = None
         self.interporlated = None
-        self._get_content()
+        self.cache = cache
+        self._dfs = {}
+        self._content = None  # Retrieved on first access, see fetch.
+        if ts_dfs is not None:
+            self._dfs = dict(ts_dfs)
+            self._content = {}
         
     def __repr__(self):
         api = "ONS"
@@ -20,19 +43,48 @@ class OnsApi:
         interporlated = f"Interpolation: {self.interporlated}"
         return " / ".join([api, data_id, ts_id, date_freq, interporlated])
 
-    def _get_content(self):
+    @property
+    def content(self):
+        """ Raw response content, retrieved on first access.
+        """
+        if self._content is None:
+            self._get_content()
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+
+    @property
+    def is_fetched(self):
+        return self._content is not None
+
+    def fetch(self):
+        """ Retrieve the content now, unless the time-series is already held.
+
+        Returns:
+            OnsApi: self
+        """
+        if not self.is_fetched:
+            self._get_content()
+        return self
+
+    def _get_content(self, revalidate=False):
         self.url = (
             f"{self.endpoint}/{self.timeseries_id}/dataset/{self.dataset_id}/data"
         )
 
-        self.req = requests.get(self.url)
+        status_code, content = cached_get(
+            self.url, cache=self.cache, source="ONS", revalidate=revalidate
+        )
 
-        if self.req.status_code == 404:
+        if status_code == 404:
             raise ConnectionError(
                 f"A 404 was issued. CCeck input parameters: {self.timeseries_id}, {self.dataset_id}"
             )
         else:
-            self.content = self.req.json()
+            self.content = json.loads(content)
+            self._dfs = {}
 
     def _freq(self, date_freq, shift=0):
         """ ONS API requires frequency inputs to be months / quarters / years.
@@ -53,43 +105,93 @@ class OnsApi:
 
     @staticmethod
     def _date_parser(df):
-        """ Parse Quarterly / Monthly date format and retrieve
-        period date index.
+        """ Parse Quarterly / Monthly / Yearly observations to period end dates,
+        from the structured year / quarter / month fields of the ONS response.
 
         Returns:
             pd.DatetimeIndex: Date time index.
         """
         if not all(df["month"] == ""):
-            period_idx = pd.PeriodIndex(df["date"], freq="M")
-        elif not all(df["quarter"] == ""):  # Check if 'Q' in date string.
-            _date = df["date"].str.replace(r"(\d+) (Q\d)", r"\1-\2", regex=True)
-            period_idx = pd.PeriodIndex(_date, freq="Q")
+            dates = pd.to_datetime(df["year"] + " " + df["month"], format="%Y %B") + MonthEnd(1)
+        elif not all(df["quarter"] == ""):
+            months = df["quarter"].str[1].astype(int) * 3
+            dates = pd.to_datetime(df["year"] + "-" + months.astype(str), format="%Y-%m") + MonthEnd(1)
         else:
-            period_idx = pd.PeriodIndex(df["date"], freq="Y")
+            dates = pd.to_datetime(df["year"], format="%Y") + YearEnd(1)
+        return pd.DatetimeIndex(dates)
 
-        return pd.to_datetime(period_idx.to_timestamp(how="e").date)
+    def _has_freq(self, date_freq):
+        return date_freq in self._dfs or bool(self.content.get(date_freq))
 
     def _ts_df(self, date_freq):
-        df = pd.DataFrame(pd.json_normalize(self.content[date_freq]))
-        df["DATE"] = self._date_parser(df)
-        df[self.timeseries_id] = df["value"].astype(float)
-        df = df.set_index("DATE")[[self.timeseries_id]]
-        return df
+        if date_freq not in self._dfs:
+            df = pd.DataFrame(pd.json_normalize(self.content[date_freq]))
+            df["DATE"] = self._date_parser(df)
+            df[self.timeseries_id] = df["value"].astype(float)
+            self._dfs[date_freq] = df.set_index("DATE")[[self.timeseries_id]]
+        if "date_freq" not in self._dfs[date_freq].attrs:
+            set_date_freq(self._dfs[date_freq], date_freq[0])
+        return self._dfs[date_freq]
+
+    def get_raw_series(self):
+        """ Retrieve the held time-series at every frequency published by ONS.
 
-    def _interporlate_ts(self, df, date_freq):
-        """ Interpolate Time-series (date-indexed) dataframe.
+        Returns:
+            dict: Time-series dataframe per frequency (m / q / y).
+        """
+        return {
+            date_freq: self._ts_df(self._freq(date_freq))
+            for date_freq in ["m", "q", "y"]
+            if self._has_freq(self._freq(date_freq))
+        }
+
+    @classmethod
+    def from_raw_series(cls, api_params, raw_series, cache=None):
+        ts_dfs = {
+            {"m": "months", "q": "quarters", "y": "years"}[date_freq]: df
+            for date_freq, df in raw_series.items()
+        }
+        return cls(**api_params, cache=cache, ts_dfs=ts_dfs)
+
+    def update(self, overlap=3):
+        """ Refresh the held time-series and report the added / revised points.
+
+        The ONS timeseries API has no date filter, so the full document is
+        requested again, bypassing the cache TTL (a conditional request where the
+        cache holds validators), and compared at the most granular frequency held.
 
         Args:
-            df (pandas.DataFrame): Time-series dataframe.
-            date_freq (str): Resampling frequency (m/q/y)
+            overlap (int, optional): Not used, as the full history is compared;
+                accepted for the common DataBank.update_data interface.
+                Defaults to 3.
 
         Returns:
-            pd.DataFrame: Interporlated time-series dataframe.
+            pandas.DataFrame: Added / revised points.
         """
-        self.interporlated = True
-        return df.resample(date_freq).interpolate(method="spline", order=3, s=0.0)
+        freq = next(
+            (freq for freq in ["months", "quarters", "years"] if self._has_freq(freq)), None
+        )
+        old_df = self._ts_df(freq) if freq is not None else None
+        self._get_content(revalidate=True)
+        if freq is None or not self._has_freq(freq):
+            return pd.DataFrame(columns=REPORT_COLUMNS)
+        return merge_history(old_df, self._ts_df(freq))[1]
+
+    def get_native_series(self, date_freq):
+        """ Retrieve the time-series at the requested frequency if published,
+        otherwise at the next, less granular, frequency.
 
-    def get_time_series(self, date_freq):
+        Args:
+            date_freq (str): m / q / y
+
+        Returns:
+            pandas.DataFrame: Time-series dataframe.
+        """
+        if not self._has_freq(self._freq(date_freq)):
+            return self._ts_df(self._freq(date_freq, 1))
+        return self._ts_df(self._freq(date_freq))
+
+    def get_time_series(self, date_freq, method="spline"):
         """ Retrieve time-series dataframe based on input date frequency.
         
         If date frequency input is more granular than the available date frequency, 
@@ -97,16 +199,18 @@ class OnsApi:
 
         Args:
             date_freq (str): m / q / y
+            method (str, optional): Interpolation method. Defaults to "spline".
 
         Returns:
             pandas.DataFrame: Time-series dataframe.
         """
         self.date_freq = date_freq
-        # If date_interval param is not included.
-        if not self.content.get(self._freq(date_freq)):
-            _df = self._ts_df(self._freq(date_freq, 1))
-            return self._interporlate_ts(_df, date_freq)
-        return self._ts_df(self._freq(date_freq))
+        native_df = self.get_native_series(date_freq)
+        df, interpolated = convert_frequency(
+            native_df, date_freq, method, [native_df.attrs["date_freq"]]
+        )
+        self.interporlated = method if interpolated.values.any() else None
+        return df
 
 
 # %%
@@ -0,0 +1,299 @@
+#%%
+import json
+import re
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from api_connect.boe_api import BoeApi
+from api_connect.hmlr_api import HmlrApi
+from api_connect.ons_api import OnsApi
+
+
+class FixtureSet:
+    """ Recorded API payloads served by ReplayServer.
+
+    * ONS: timeseries documents keyed by "dataset_id/timeseries_id".
+    * BOE: series keyed by IADB series code.
+    * HMLR: monthly series keyed by "region/query_var".
+    """
+
+    def __init__(self, ons=None, boe=None, hmlr=None):
+        self.ons = ons or {}
+        self.boe = boe or {}
+        self.hmlr = hmlr or {}
+
+    def __repr__(self):
+        return f"FixtureSet: ONS {len(self.ons)} / BOE {len(self.boe)} / HMLR {len(self.hmlr)}"
+
+    @staticmethod
+    def _ons_doc(raw_series):
+        """ ONS timeseries document from time-series per frequency (m / q / y).
+        """
+        doc = {"months": [], "quarters": [], "years": []}
+        for date_freq, df in raw_series.items():
+            periods = df.index.to_period(date_freq.upper())
+            for period, value in zip(periods, df.iloc[:, 0]):
+                doc[{"m": "months", "q": "quarters", "y": "years"}[date_freq]].append(
+                    {
+                        "date": {
+                            "m": f"{period.year} {period.strftime('%b').upper()}",
+                            "q": f"{period.year} Q{period.quarter}",
+                            "y": f"{period.year}",
+                        }[date_freq],
+                        "value": f"{value}",
+                        "month": period.strftime("%B") if date_freq == "m" else "",
+                        "quarter": f"Q{period.quarter}" if date_freq == "q" else "",
+                        "year": f"{period.year}",
+                    }
+                )
+        return doc
+
+    @classmethod
+    def from_databank(cls, databank):
+        """ Record the series held by a DataBank.
+
+        Args:
+            databank (DataBank): DataBank with retrieved series.
+
+        Returns:
+            FixtureSet: Recorded fixtures.
+        """
+        fixtures = cls()
+        for (api_name, params), _api_obj in databank.series.items():
+            params = dict(params)
+            raw_series = _api_obj.get_raw_series()
+            if api_name == "ONS":
+                key = f"{params['dataset_id']}/{params['timeseries_id']}"
+                fixtures.ons[key] = _api_obj.content or cls._ons_doc(raw_series)
+            elif api_name == "BOE":
+                fixtures.boe[params["series_code"]] = next(iter(raw_series.values())).iloc[:, 0]
+            elif api_name == "HMLR":
+                key = f"{params.get('region', 'united-kingdom')}/{params['query_var']}"
+                fixtures.hmlr[key] = raw_series["m"].iloc[:, 0]
+        return fixtures
+
+    @classmethod
+    def synthetic(cls, n_series, start="1990-01-01", end="2022-12-31", seed=0):
+        """ Random-walk fixtures with n_series series per source.
+
+        Returns:
+            FixtureSet: Synthetic fixtures.
+        """
+        rng = np.random.default_rng(seed)
+        months = pd.date_range(start, end, freq="M")
+
+        def random_walk(index):
+            return pd.Series(100 + rng.normal(size=len(index)).cumsum(), index=index)
+
+        fixtures = cls()
+        for i in range(n_series):
+            monthly = random_walk(months).to_frame(f"S{i:03d}")
+            fixtures.ons[f"SYN/S{i:03d}"] = cls._ons_doc(
+                {
+                    "m": monthly,
+                    "q": monthly.resample("Q").mean(),
+                    "y": monthly.resample("Y").mean(),
+                }
+            )
+            fixtures.boe[f"B{i:03d}"] = random_walk(months)
+            fixtures.hmlr[f"region-{i:03d}/housePriceIndex"] = random_walk(months)
+        return fixtures
+
+    def save(self, path):
+        def to_dict(series):
+            return {f"{date:%Y-%m-%d}": value for date, value in series.items()}
+
+        payload = {
+            "ONS": self.ons,
+            "BOE": {key: to_dict(series) for key, series in self.boe.items()},
+            "HMLR": {key: to_dict(series) for key, series in self.hmlr.items()},
+        }
+        with open(path, "w") as f:
+            json.dump(payload, f)
+
+    @classmethod
+    def load(cls, path):
+        def to_series(values):
+            return pd.Series(values, index=pd.to_datetime(list(values)), dtype=float)
+
+        with open(path) as f:
+            payload = json.load(f)
+        return cls(
+            ons=payload["ONS"],
+            boe={key: to_series(values) for key, values in payload["BOE"].items()},
+            hmlr={key: to_series(values) for key, values in payload["HMLR"].items()},
+        )
+
+
+class ReplayServer:
+    """ Local stand-in for the ONS, BOE and HMLR endpoints serving a FixtureSet.
+
+    While used as a context manager, the connector endpoints point at the local
+    server. Latency and error injection are configurable, and the number of
+    requests and bytes sent are counted per source.
+
+    Example:
+        >>> with ReplayServer(FixtureSet.synthetic(20), latency=0.05) as server:
+        ...     DataBank().retrieve_data("BOE", [{"series_code": "B000"}], "q")
+        ...     server.stats()
+    """
+
+    def __init__(self, fixtures, latency=0.0, error_rate=0.0, error_status=503, seed=0):
+        """
+
+        Args:
+            fixtures (FixtureSet): Recorded payloads.
+            latency (float, optional): Delay per request in seconds. Defaults to 0.0.
+            error_rate (float, optional): Probability of an injected error response.
+                Defaults to 0.0.
+            error_status (int, optional): Status code of injected errors.
+                Defaults to 503.
+            seed (int, optional): Error injection seed. Defaults to 0.
+        """
+        self.fixtures = fixtures
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._endpoints = None
+        self.requests = Counter()
+        self.bytes_sent = Counter()
+        self.errors = Counter()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def __repr__(self):
+        return f"ReplayServer: {self.url} / Latency: {self.latency}s / Error rate: {self.error_rate}"
+
+    def __enter__(self):
+        self.start()
+        self._endpoints = (OnsApi.endpoint, BoeApi.endpoint, HmlrApi.endpoint)
+        OnsApi.endpoint = f"{self.url}/ons/timeseries"
+        BoeApi.endpoint = f"{self.url}/boe?csv.x=yes"
+        HmlrApi.endpoint = f"{self.url}/hmlr/query"
+        return self
+
+    def __exit__(self, *exc):
+        OnsApi.endpoint, BoeApi.endpoint, HmlrApi.endpoint = self._endpoints
+        self.stop()
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self):
+        self.requests, self.bytes_sent, self.errors = Counter(), Counter(), Counter()
+
+    def stats(self):
+        return {
+            "requests": sum(self.requests.values()),
+            "bytes": sum(self.bytes_sent.values()),
+            "errors": sum(self.errors.values()),
+            "per_source": {
+                source: {"requests": n, "bytes": self.bytes_sent[source]}
+                for source, n in self.requests.items()
+            },
+        }
+
+    def _ons(self, path, query):
+        match = re.match(r"/ons/timeseries/([^/]+)/dataset/([^/]+)/data", path)
+        doc = match and self.fixtures.ons.get(f"{match[2]}/{match[1]}")
+        if doc is None:
+            return 404, "application/json", b"{}"
+        return 200, "application/json", json.dumps(doc).encode()
+
+    def _boe(self, path, query):
+        codes = query.get("SeriesCodes", [""])[0].split(",")
+        series = {code: self.fixtures.boe[code] for code in codes if code in self.fixtures.boe}
+        if not series:
+            return 404, "text/csv", b""
+        df = pd.DataFrame(series)
+        if "Datefrom" in query:
+            df = df[df.index >= pd.to_datetime(query["Datefrom"][0], format="%d/%b/%Y")]
+        df.index = df.index.strftime("%d %b %Y")
+        df.index.name = "DATE"
+        return 200, "text/csv", df.to_csv().encode()
+
+    def _hmlr(self, path, query):
+        sparql = query.get("query", [""])[0]
+        select_vars = re.search(r"SELECT\s+(.*)", sparql)[1].replace("?", "").split()
+        regions = re.findall(r"/id/region/([^>]+)>", sparql)
+        start = re.search(r'STR\(\?DATE\) >= "([\d-]+)"', sparql)
+        query_vars = [var for var in select_vars if var not in ["DATE", "Region"]]
+
+        bindings = []
+        for region in regions:
+            df = pd.DataFrame(
+                {
+                    var: self.fixtures.hmlr[f"{region}/{var}"]
+                    for var in query_vars
+                    if f"{region}/{var}" in self.fixtures.hmlr
+                }
+            )
+            if start is not None:
+                df = df[df.index.strftime("%Y-%m") >= start[1]]
+            for date, row in df.iterrows():
+                binding = {
+                    "DATE": {"type": "literal", "value": f"{date:%Y-%m}"},
+                    "Region": {"type": "uri", "value": f"{HmlrApi.region_uri}{region}"},
+                }
+                for var, value in row.dropna().items():
+                    binding[var] = {"type": "literal", "value": f"{value}"}
+                bindings.append(binding)
+        content = {"head": {"vars": select_vars}, "results": {"bindings": bindings}}
+        return 200, "application/sparql-results+json", json.dumps(content).encode()
+
+    def _handler(self):
+        server = self
+        routes = {"/ons": ("ONS", self._ons), "/boe": ("BOE", self._boe), "/hmlr": ("HMLR", self._hmlr)}
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, query):
+                path = urllib.parse.urlparse(self.path).path
+                source, route = next(
+                    (route for prefix, route in routes.items() if path.startswith(prefix)),
+                    ("UNKNOWN", lambda *_: (404, "text/plain", b"")),
+                )
+                time.sleep(server.latency)
+                with server._lock:
+                    inject_error = server._rng.random() < server.error_rate
+                if inject_error:
+                    status, content_type, body = server.error_status, "text/plain", b""
+                    server.errors[source] += 1
+                else:
+                    status, content_type, body = route(path, query)
+
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with server._lock:
+                    server.requests[source] += 1
+                    server.bytes_sent[source] += len(body)
+
+            def do_GET(self):
+                self._respond(urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self._respond(urllib.parse.parse_qs(self.rfile.read(length).decode()))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# %%
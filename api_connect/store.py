@@ -0,0 +1,170 @@
+#%%
+import json
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+
+class SeriesStore:
+    """ Local columnar store of raw time-series.
+
+    Series are partitioned by native frequency (d / m / q / y). Each partition is
+    an uncompressed Arrow IPC (Feather v2) file with a DATE column and one column
+    per series, so loading memory-maps the file and only reads the pages of the
+    selected columns. Source, parameters, native frequency and fetch time of each
+    series are kept in the partition schema metadata.
+
+    * NOTE:
+        Requires pyarrow.
+    """
+
+    metadata_key = b"api_connect"
+
+    def __init__(self, store_dir="~/.cache/api_connect/store"):
+        """
+
+        Args:
+            store_dir (str, optional): Store directory.
+                Defaults to "~/.cache/api_connect/store".
+        """
+        if pa is None:
+            raise ImportError("SeriesStore requires pyarrow: pip install pyarrow")
+        self.store_dir = Path(store_dir).expanduser()
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"SeriesStore: {self.store_dir} / Partitions: {self.partitions()}"
+
+    @staticmethod
+    def series_id(key):
+        """ Column name of a series, e.g. ONS/dataset_id=LMS/timeseries_id=MGSX.
+
+        Args:
+            key (tuple): (API name, sorted API input parameter items).
+
+        Returns:
+            str: Series ID.
+        """
+        api_name, params = key
+        return "/".join([api_name, *(f"{name}={value}" for name, value in params)])
+
+    def _path(self, date_freq):
+        return self.store_dir / f"{date_freq}.arrow"
+
+    def partitions(self):
+        return sorted(path.stem for path in self.store_dir.glob("*.arrow"))
+
+    def _open(self, date_freq):
+        """ Memory-map a partition without reading its columns.
+
+        Returns:
+            tuple(pyarrow.Table, dict): Partition table, series metadata.
+        """
+        source = pa.memory_map(str(self._path(date_freq)))
+        table = pa.ipc.open_file(source).read_all()
+        metadata = json.loads((table.schema.metadata or {}).get(self.metadata_key, b"{}"))
+        return table, metadata
+
+    def metadata(self):
+        """ Metadata of every stored series.
+
+        Returns:
+            pandas.DataFrame: Series ID, source, parameters, native frequency and
+                fetch time.
+        """
+        rows = []
+        for date_freq in self.partitions():
+            _, metadata = self._open(date_freq)
+            rows.extend({"Series ID": series_id, **meta} for series_id, meta in metadata.items())
+        return pd.DataFrame(rows)
+
+    def keys(self):
+        """ Stored series keys.
+
+        Returns:
+            set: (API name, sorted API input parameter items) tuples.
+        """
+        metadata = self.metadata()
+        if metadata.empty:
+            return set()
+        return {
+            (source, tuple(sorted(params.items())))
+            for source, params in zip(metadata["source"], metadata["params"])
+        }
+
+    def load(self, keys):
+        """ Load stored series, reading only the selected columns.
+
+        Args:
+            keys (list): (API name, sorted API input parameter items) tuples.
+
+        Returns:
+            dict: Time-series dataframe per native frequency, per stored key.
+        """
+        series_ids = {self.series_id(key): key for key in keys}
+        output = {}
+        for date_freq in self.partitions():
+            table, metadata = self._open(date_freq)
+            columns = [name for name in table.column_names if name in series_ids]
+            if not columns:
+                continue
+            df = table.select(["DATE", *columns]).to_pandas().set_index("DATE")
+            for series_id in columns:
+                ts_df = df[[series_id]].dropna()
+                ts_df.columns = [metadata[series_id]["name"]]
+                output.setdefault(series_ids[series_id], {})[date_freq] = ts_df
+        return output
+
+    def save(self, raw_series):
+        """ Write raw series, replacing any stored version.
+
+        Args:
+            raw_series (dict): Time-series dataframe per native frequency, per key.
+        """
+        fetched_at = pd.Timestamp.now().isoformat()
+        partitions = {}
+        for key, frames in raw_series.items():
+            for date_freq, df in frames.items():
+                series_id = self.series_id(key)
+                meta = {
+                    "name": df.columns[0],
+                    "source": key[0],
+                    "params": dict(key[1]),
+                    "native_freq": date_freq,
+                    "fetched_at": fetched_at,
+                }
+                partitions.setdefault(date_freq, {})[series_id] = (df.iloc[:, 0], meta)
+
+        with self._lock:
+            for date_freq, columns in partitions.items():
+                if self._path(date_freq).exists():
+                    table, metadata = self._open(date_freq)
+                    stored = table.to_pandas().set_index("DATE")
+                    stored = stored.drop(columns=list(columns), errors="ignore")
+                else:
+                    stored, metadata = pd.DataFrame(), {}
+
+                new = pd.DataFrame({series_id: ts for series_id, (ts, _) in columns.items()})
+                metadata.update({series_id: meta for series_id, (_, meta) in columns.items()})
+                df = pd.concat([stored, new], axis=1).sort_index()
+                df.index.name = "DATE"
+
+                table = pa.Table.from_pandas(df.reset_index(), preserve_index=False)
+                table = table.replace_schema_metadata(
+                    {self.metadata_key: json.dumps(metadata).encode()}
+                )
+                tmp_path = self._path(date_freq).with_suffix(".tmp")
+                feather.write_feather(table, str(tmp_path), compression="uncompressed")
+                os.replace(tmp_path, self._path(date_freq))
+
+
+# %%
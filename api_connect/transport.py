@@ -0,0 +1,168 @@
+#%%
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TokenBucket:
+    """ Token bucket rate limiter.
+
+    Tokens refill at 'rate' per second up to 'capacity', and each request takes
+    one token, blocking until one is available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Transport:
+    """ Shared HTTP layer of the API connectors.
+
+    Keeps one pooled keep-alive session per host, limits the request rate per
+    host with a token bucket, and retries timeouts, connection errors, 429 and
+    5xx responses with exponential backoff (honouring Retry-After).
+    """
+
+    retry_status = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        timeout=(5, 60),
+        max_retries=4,
+        backoff=0.5,
+        max_backoff=30,
+        rate_limits=None,
+        pool_size=8,
+    ):
+        """
+
+        Args:
+            timeout (tuple, optional): (connect, read) timeout in seconds.
+                Defaults to (5, 60).
+            max_retries (int, optional): Retries after the first attempt. Defaults to 4.
+            backoff (float, optional): Backoff base in seconds, doubled on every
+                retry. Defaults to 0.5.
+            max_backoff (float, optional): Maximum backoff in seconds. Defaults to 30.
+            rate_limits (dict, optional): Requests per second per host, e.g.
+                {"api.ons.gov.uk": 10}. Hosts not listed are not rate limited.
+                Defaults to None.
+            pool_size (int, optional): Keep-alive connections per host. Defaults to 8.
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limits = {
+            "api.ons.gov.uk": 10,
+            "www.bankofengland.co.uk": 5,
+            "landregistry.data.gov.uk": 2,
+        }
+        if rate_limits is not None:
+            self.rate_limits.update(rate_limits)
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Transport: Timeout {self.timeout} / Retries {self.max_retries} / Rate limits {self.rate_limits}"
+
+    def _session(self, host):
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+                if self.rate_limits.get(host):
+                    self._buckets[host] = TokenBucket(self.rate_limits[host])
+            return self._sessions[host], self._buckets.get(host)
+
+    def _wait(self, attempt, response=None):
+        retry_after = response is not None and response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+        time.sleep(min(delay, self.max_backoff))
+
+    def request(self, method, url, **kwargs):
+        """ Send a request with rate limiting and retries.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Request URL.
+            **kwargs: requests.Session.request keyword arguments.
+
+        Raises:
+            ConnectionError: If the request still fails after 'max_retries'.
+
+        Returns:
+            requests.Response: Response.
+        """
+        session, bucket = self._session(urllib.parse.urlparse(url).netloc)
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.Timeout, requests.ConnectionError) as err:
+                if attempt == self.max_retries:
+                    raise ConnectionError(f"Request failed: {url}") from err
+                self._wait(attempt)
+                continue
+            if response.status_code not in self.retry_status:
+                return response
+            if attempt == self.max_retries:
+                raise ConnectionError(
+                    f"A {response.status_code} was issued after {self.max_retries} retries: {url}"
+                )
+            self._wait(attempt, response)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+_default_transport = Transport()
+
+
+def get_transport():
+    return _default_transport
+
+
+def set_transport(transport):
+    """ Replace the transport shared by all API connectors.
+
+    Args:
+        transport (Transport): Transport, e.g. with different timeouts or rate limits.
+    """
+    global _default_transport
+    _default_transport = transport
+
+
+# %%
@@ -0,0 +1,131 @@
+# %%
+""" Latency / throughput benchmark of api_connect against the offline ReplayServer.
+
+For a growing number of series per source, the same ONS / BOE / HMLR request set
+is retrieved through DataBank in several modes, and the wall time, requests
+issued, bytes transferred and parse time are written to a JSON report.
+
+    python bench_api_connect.py --series 5 10 20 50 --latency 0.05 --output bench_report.json
+"""
+import argparse
+import json
+import tempfile
+import time
+from contextlib import contextmanager
+
+from api_connect.boe_api import BoeApi
+from api_connect.cache import DiskCache
+from api_connect.connector import DataBank
+from api_connect.hmlr_api import HmlrApi
+from api_connect.ons_api import OnsApi
+from api_connect.replay import FixtureSet, ReplayServer
+from api_connect.transport import Transport, set_transport
+
+PARSERS = [(OnsApi, "_ts_df"), (BoeApi, "_parse_content"), (HmlrApi, "_parse_content")]
+
+
+@contextmanager
+def parse_timer():
+    """ Accumulate the time spent in the connector parsers.
+    """
+    elapsed = {"seconds": 0.0}
+    originals = [(cls, name, cls.__dict__[name]) for cls, name in PARSERS]
+
+    def timed(func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed["seconds"] += time.perf_counter() - start
+
+        return wrapper
+
+    for cls, name, original in originals:
+        if isinstance(original, (classmethod, staticmethod)):
+            setattr(cls, name, type(original)(timed(original.__func__)))
+        else:
+            setattr(cls, name, timed(original))
+    try:
+        yield elapsed
+    finally:
+        for cls, name, original in originals:
+            setattr(cls, name, original)
+
+
+def request_set(n_series):
+    return (
+        [("ONS", {"dataset_id": "SYN", "timeseries_id": f"S{i:03d}"}) for i in range(n_series)]
+        + [("BOE", {"series_code": f"B{i:03d}"}) for i in range(n_series)]
+        + [
+            ("HMLR", {"query_var": "housePriceIndex", "region": f"region-{i:03d}"})
+            for i in range(n_series)
+        ]
+    )
+
+
+def run_mode(server, mode, requests, date_interval, cache):
+    databank = DataBank(cache=cache)
+    server.reset_stats()
+    with parse_timer() as parse_time:
+        start = time.perf_counter()
+        max_workers = 1 if mode == "sequential" else None
+        databank.retrieve_many(requests, date_interval, max_workers=max_workers)
+        wall_time = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "wall_time": wall_time,
+        "parse_time": parse_time["seconds"],
+        "series_errors": len(databank.errors),
+        **server.stats(),
+    }
+
+
+def run_benchmark(series_counts, latency=0.05, error_rate=0.0, date_interval="m"):
+    # Injected errors are retried; keep the backoff in line with the replay latency.
+    set_transport(Transport(backoff=latency))
+    fixtures = FixtureSet.synthetic(max(series_counts))
+    results = []
+    with ReplayServer(fixtures, latency=latency, error_rate=error_rate) as server:
+        for n_series in series_counts:
+            requests = request_set(n_series)
+            cache = DiskCache(tempfile.mkdtemp(), ttl=3600)
+            for mode, _cache in [
+                ("sequential", None),
+                ("concurrent", None),
+                ("concurrent_cold_cache", cache),
+                ("concurrent_warm_cache", cache),
+            ]:
+                result = run_mode(server, mode, requests, date_interval, _cache)
+                results.append({"n_series": n_series, "n_requests": len(requests), **result})
+                print(
+                    f"{n_series:>4} series x 3 sources / {mode:<22} "
+                    f"{result['wall_time']:.3f}s / {result['requests']} requests / "
+                    f"{result['bytes']} bytes / parse {result['parse_time']:.3f}s"
+                )
+    return {
+        "config": {
+            "series_counts": series_counts,
+            "latency": latency,
+            "error_rate": error_rate,
+            "date_interval": date_interval,
+        },
+        "results": results,
+    }
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--series", type=int, nargs="+", default=[5, 10, 20, 50])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--date-interval", default="m")
+    parser.add_argument("--output", default="bench_report.json")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.series, args.latency, args.error_rate, args.date_interval)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+# %%
@@ -0,0 +1,366 @@
+# %%
+import pandas as pd
+
+from api_connect.connector import DataBank
+from preprocess import fingerprint
+
+
+def compare_lists(list1, list2):
+    """ Check if list1 is a subset of list 2. If not, raise an error.
+
+
+    Args:
+        list1 (list): A subset list.
+        list2 (list): A comparable list.
+
+    Raises:
+        ValueError: A list of variables missing in list2 from list1
+    """
+    if not set(list1) <= set(list2):
+        req_vars = set(list1).difference(set(list2))
+        raise ValueError(f"Missing: {req_vars}")
+
+
+def udsc_ts(df):
+    """ Retrieve Unsecured Debt Servicing Cost with the dataframe containing:
+        - Card int rate: IUMCCTL (BOE)
+        - Card bal: LPMVZRE (BOE)
+        - Loans int rate: IUMBX67 (BOE)
+        - Total Unsec bal: LPMBI2P (BOE)
+        - Disposable income: RPHQ (ONS)
+
+        Formula:
+        $$ UDSC = 100*\frac{\text{Card int rate} * \text{Card bal}+(\text{Loans int rate * (\text{Total Unsec bal} - \text{Card bal})})}{\text{Disposable Income}} $$
+
+    Args:
+        df (pandas.DataFrame): pandas.DataFrame with specific macro variables.
+
+    Returns:
+        pandas.Series: USDC time-series.
+    """
+    macro_vars = ["IUMCCTL", "LPMVZRE", "IUMBX67", "LPMBI2P", "RPHQ"]
+    compare_lists(macro_vars, df.columns)
+
+    denom1 = df["IUMCCTL"].divide(100) * df["LPMVZRE"]
+    denom2 = df["IUMBX67"].divide(100) * (df["LPMBI2P"] - df["LPMVZRE"])
+    output = 100 * (denom1 + denom2) / df["RPHQ"]
+    return output.rename("UDCS")
+
+
+def uk_cig_ts(df):
+    """ Retrieve UK Corporate Income Gearing with the dataframe containing:
+        - Total interest: UKEA/I6PK (ONS)
+        - Total resource: UKEA/RPBN (ONS)
+        - Taxes on income and wealth: UKEA/RPLA (ONS)
+
+        Formula:
+        $$ CIG = \frac{\text{Total Interest}}{(\text{Total resource} - \text{Taxes on income and wealth})} $$
+    Args:
+        df (pandas.DataFrame): pandas.DataFrame with specific macro variables.
+
+    Returns:
+        pandas.Series: UK CIG time-series.
+    """
+    macro_vars = ["I6PK", "RPBN", "RPLA"]
+    compare_lists(macro_vars, df.columns)
+    output = df["I6PK"] / (df["RPBN"] - df["RPLA"])
+    return output.rename("UKCIG")
+
+
+def uk_corp_profits_ts(df):
+    """ Retrieve UK Corporate Profits with the dataframe containing:
+        - PN2/YBHA (ONS)
+        - UKEA/ROYJ (ONS)
+        - UKEA/ROYH (ONS)
+        - UKEA/ROYK (ONS)
+
+        Formula:
+        $$ \text{Corporate Profits} = \text{Nominal GDP} - \text{Pre-tax labour income} $$
+    Args:
+        df (pandas.DataFrame): pandas.DataFrame with specific macro variables.
+
+    Returns:
+        pandas.Series: UK Corporate Profits time-series.
+    """
+    macro_vars = ["YBHA", "ROYJ", "ROYH", "ROYK"]
+    compare_lists(macro_vars, df.columns)
+    output = df["YBHA"] - df["ROYJ"] + df["ROYH"] - df["ROYK"]
+    return output.rename("UKCPROF")
+
+
+def pnfc_lending_ts(df):
+    """ Retrieve Total Lending to PNFCs with the dataframe containing:
+        - UKEA/NLBC (ONS)
+        - UKEA/NKZA (ONS)
+
+    Args:
+        df (pandas.DataFrame): pandas.DataFrame with specific macro variables.
+
+    Returns:
+        pandas.Series: Total Lending to PNFCs time-series.
+    """
+    macro_vars = ["NLBC", "NKZA"]
+    compare_lists(macro_vars, df.columns)
+    output = df["NLBC"] + df["NKZA"]
+    return output.rename("PNFCLEND")
+
+
+class RawInput:
+    """ Raw series input of a derived indicator.
+    """
+
+    id_params = {"ONS": "timeseries_id", "BOE": "series_code", "HMLR": "query_var"}
+
+    def __init__(self, source, freq, **params):
+        """
+
+        Args:
+            source (str): Registered DataBank API name, e.g. ONS / BOE / HMLR.
+            freq (str): Native frequency of the series, m / q / y.
+            **params: API input parameters, e.g. dataset_id="UKEA", timeseries_id="NLBC".
+        """
+        self.source = source
+        self.freq = freq
+        self.params = params
+
+    def __repr__(self):
+        return f"RawInput: {self.source} / {self.params} / Native frequency: {self.freq}"
+
+    @property
+    def name(self):
+        """ Column name of the series in the input dataframe of an indicator.
+        """
+        return self.params[self.id_params.get(self.source, next(iter(self.params)))]
+
+    @property
+    def key(self):
+        return (self.source, tuple(sorted(self.params.items())))
+
+
+class Indicator:
+    """ Derived indicator computed from raw series and / or other indicators.
+    """
+
+    def __init__(self, name, inputs, func, description=""):
+        """
+
+        Args:
+            name (str): Indicator name, also the output column name.
+            inputs (list): RawInput objects and / or names of other indicators.
+            func (callable): Function of a dataframe with one column per input
+                (RawInput.name / indicator name) returning a pandas.Series.
+            description (str, optional): Description. Defaults to "".
+        """
+        self.name = name
+        self.inputs = inputs
+        self.func = func
+        self.description = description
+
+    def __repr__(self):
+        inputs = [_input if isinstance(_input, str) else _input.name for _input in self.inputs]
+        return f"Indicator: {self.name} / Inputs: {inputs}"
+
+
+class IndicatorRegistry:
+    """ Registry of derived indicators resolved as a dependency DAG.
+
+    Computing a set of indicators fetches only the raw series they need, through
+    a single DataBank request, and computes every intermediate indicator once.
+    Results are cached per (indicator, frequency, interpolation) and reused
+    until the indicator inputs change.
+
+    Example:
+        >>> registry = default_registry(DataBank(cache=DiskCache()))
+        >>> registry.compute(["UDSC", "PNFCLEND"], "m")
+    """
+
+    def __init__(self, databank=None):
+        """
+
+        Args:
+            databank (DataBank, optional): DataBank used to fetch the raw series.
+                Defaults to None, a new DataBank.
+        """
+        self.databank = databank if databank is not None else DataBank()
+        self.indicators = {}
+        self.errors = {}
+        self._results = {}  # (name, date_interval, method) -> (input fingerprint, output)
+
+    def __repr__(self):
+        return f"IndicatorRegistry: {list(self.indicators)}"
+
+    def register(self, indicator):
+        self.indicators[indicator.name] = indicator
+
+    def resolve(self, names):
+        """ Resolve the indicators and their dependencies.
+
+        Args:
+            names (list): Indicator names.
+
+        Raises:
+            KeyError: If an indicator is not registered.
+            ValueError: If the dependencies are cyclic.
+
+        Returns:
+            tuple(list, list): Indicator names in dependency order, raw inputs.
+        """
+        order, raw_inputs, state = [], {}, {}
+
+        def visit(name):
+            if name not in self.indicators:
+                raise KeyError(f"Indicator is not registered: {name}.")
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Cyclic indicator dependency: {name}.")
+            state[name] = "visiting"
+            for _input in self.indicators[name].inputs:
+                if isinstance(_input, str):
+                    visit(_input)
+                else:
+                    raw_inputs.setdefault(_input.key, _input)
+            state[name] = "done"
+            order.append(name)
+
+        for name in names:
+            visit(name)
+        return order, list(raw_inputs.values())
+
+    def native_freq(self, name):
+        """ Least granular native frequency among the raw inputs of an indicator.
+
+        Returns:
+            str: m / q / y
+        """
+        _, raw_inputs = self.resolve([name])
+        return min((_input.freq for _input in raw_inputs), key=["y", "q", "m"].index)
+
+    def compute(self, names, date_interval, method="spline"):
+        """ Compute derived indicators.
+
+        Indicators whose inputs could not be retrieved or computed are left out
+        of the output and the error is recorded in 'errors'.
+
+        Args:
+            names (list): Indicator names.
+            date_interval (str): m / q / y
+            method (str, optional): Interpolation method. Defaults to "spline".
+
+        Returns:
+            pandas.DataFrame: One column per indicator in the order of names.
+        """
+        order, raw_inputs = self.resolve(names)
+        n_errors = len(self.databank.errors)
+        raw_df = self.databank.retrieve_many(
+            [(_input.source, _input.params) for _input in raw_inputs],
+            date_interval,
+            method=method,
+        )
+        # Columns are matched to the inputs by position, as series from different
+        # datasets / regions may share a name. Failed requests are left out.
+        failed = {
+            self.databank._series_key(error["API"], error["Parameters"])
+            for error in self.databank.errors[n_errors:]
+        }
+        positions = {
+            key: i
+            for i, key in enumerate(_input.key for _input in raw_inputs if _input.key not in failed)
+        }
+
+        outputs = {}
+        for name in order:
+            indicator = self.indicators[name]
+            try:
+                columns = []
+                for _input in indicator.inputs:
+                    if isinstance(_input, str):
+                        if _input not in outputs:
+                            raise ValueError(f"Input indicator failed: {_input}")
+                        columns.append(outputs[_input].rename(_input))
+                    elif _input.key not in positions:
+                        raise ValueError(f"Input series failed: {_input}")
+                    else:
+                        columns.append(raw_df.iloc[:, positions[_input.key]].rename(_input.name))
+                df = pd.concat(columns, axis=1)
+                input_key = fingerprint(df)
+                result_key = (name, date_interval, method)
+                cached = self._results.get(result_key)
+                if cached is not None and cached[0] == input_key:
+                    outputs[name] = cached[1]
+                    continue
+                outputs[name] = indicator.func(df).rename(name)
+                self._results[result_key] = (input_key, outputs[name])
+                self.errors.pop(name, None)
+            except Exception as err:
+                self.errors[name] = err
+
+        outputs = [outputs[name] for name in dict.fromkeys(names) if name in outputs]
+        return pd.concat(outputs, axis=1) if outputs else pd.DataFrame()
+
+
+def default_registry(databank=None):
+    """ Registry of the derived indicators listed in macro_var.md.
+
+    Args:
+        databank (DataBank, optional): DataBank used to fetch the raw series.
+            Defaults to None, a new DataBank.
+
+    Returns:
+        IndicatorRegistry: Registry.
+    """
+    registry = IndicatorRegistry(databank)
+    registry.register(
+        Indicator(
+            "UDSC",
+            [
+                RawInput("BOE", "m", series_code="IUMCCTL"),
+                RawInput("BOE", "m", series_code="LPMVZRE"),
+                RawInput("BOE", "m", series_code="IUMBX67"),
+                RawInput("BOE", "m", series_code="LPMBI2P"),
+                RawInput("ONS", "q", dataset_id="UKEA", timeseries_id="RPHQ"),
+            ],
+            udsc_ts,
+            "Unsecured Debt Servicing Cost",
+        )
+    )
+    registry.register(
+        Indicator(
+            "UKCIG",
+            [
+                RawInput("ONS", "q", dataset_id="UKEA", timeseries_id="I6PK"),
+                RawInput("ONS", "q", dataset_id="UKEA", timeseries_id="RPBN"),
+                RawInput("ONS", "q", dataset_id="UKEA", timeseries_id="RPLA"),
+            ],
+            uk_cig_ts,
+            "UK Corporate Income Gearing",
+        )
+    )
+    registry.register(
+        Indicator(
+            "UKCPROF",
+            [
+                RawInput("ONS", "q", dataset_id="PN2", timeseries_id="YBHA"),
+                RawInput("ONS", "q", dataset_id="UKEA", timeseries_id="ROYJ"),
+                RawInput("ONS", "q", dataset_id="UKEA", timeseries_id="ROYH"),
+                RawInput("ONS", "q", dataset_id="UKEA", timeseries_id="ROYK"),
+            ],
+            uk_corp_profits_ts,
+            "UK Corporate Profits",
+        )
+    )
+    registry.register(
+        Indicator(
+            "PNFCLEND",
+            [
+                RawInput("ONS", "q", dataset_id="UKEA", timeseries_id="NLBC"),
+                RawInput("ONS", "q", dataset_id="UKEA", timeseries_id="NKZA"),
+            ],
+            pnfc_lending_ts,
+            "Total Lending to PNFCs",
+        )
+    )
+    return registry
+
+
+# %%
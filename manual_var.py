@@ -1,13 +1,38 @@
 #%%
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import linalg
+
+from api_connect.frequency import N_MONTH, get_date_freq, period_end
+
+# Deterministic terms per regression type, in regressor order.
+DETERMINISTIC_TERMS = {
+    "n": [],
+    "c": ["Intercept"],
+    "ct": ["Intercept", "Trend"],
+    "ctt": ["Intercept", "Trend", "Trend^2"],
+}
+
 
-df = pd.read_csv("/Users/anko/Downloads/T8-svar/za_dat1.csv")
-df_mat = df.to_numpy()
 # %%
 def lag_matrix(mat, p):
-    lag_mats = [mat[i : -p + i] for i in reversed(range(p))]
-    return np.hstack(lag_mats)
+    """ Lagged regressors [y(t-1), ..., y(t-p)] for t = p, ..., n - 1.
+
+    Built from a sliding window view of mat; the only copy is the returned array.
+
+    Args:
+        mat (numpy.ndarray): (n, k) data, or (..., n, k) for a batch of samples.
+        p (int): Lag order.
+
+    Returns:
+        numpy.ndarray: (..., n - p, k * p) lag matrix, lag-major columns.
+    """
+    windows = sliding_window_view(mat, p, axis=-2)[..., :-1, :, ::-1]  # (..., n - p, k, p)
+    return windows.swapaxes(-1, -2).reshape(*windows.shape[:-2], -1)
 
 
 def design_matrix(mat, intercept=True):
@@ -17,40 +42,971 @@ def design_matrix(mat, intercept=True):
         return mat
 
 
+def deterministic_matrix(start, stop, reg_type="c"):
+    """ Deterministic regressors for observations start, ..., stop - 1.
+
+    The trend is the 1-based observation number, as in statsmodels VAR.
+
+    Returns:
+        numpy.ndarray: (stop - start, # of terms) array.
+    """
+    trend = np.arange(start + 1, stop + 1, dtype=float)
+    terms = {"Intercept": np.ones_like(trend), "Trend": trend, "Trend^2": trend ** 2}
+    return np.column_stack(
+        [terms[name] for name in DETERMINISTIC_TERMS[reg_type]] or [np.empty((len(trend), 0))]
+    )
+
+
+def cross_products(mat, p, reg_type="c", offset=0):
+    """ X'X, X'Y and Y'Y of the VAR regression of y(t) on
+    [deterministic terms, y(t-1), ..., y(t-p)] for t = offset + p, ..., n - 1.
+
+    The design matrix is never built. The lag blocks are nearly Toeplitz: the
+    cross product of lags i <= j is the lag (j - i) autocross product over the
+    sample, corrected for the i observations entering and leaving at the ends.
+    Only p + 1 products over the sample are therefore needed.
+
+    Args:
+        mat (numpy.ndarray): (n, k) data.
+        p (int): Lag order.
+        reg_type (str, optional): n / c / ct / ctt. Defaults to "c".
+        offset (int, optional): Observations skipped at the start, e.g. to
+            compare lag orders on a common sample. Defaults to 0.
+
+    Returns:
+        tuple(numpy.ndarray): X'X (m, m), X'Y (m, k), Y'Y (k, k), with m = d + k * p.
+    """
+    n, k = mat.shape
+    start = offset + p
+    det = deterministic_matrix(start, n, reg_type)
+    d = det.shape[1]
+    y = mat[start:]
+    # autocross[h] = sum_t y(t) y(t-h)' over the sample.
+    autocross = [y.T @ mat[start - h : n - h] for h in range(p + 1)]
+
+    xtx = np.empty((d + k * p, d + k * p))
+    xty = np.empty((d + k * p, k))
+    xtx[:d, :d] = det.T @ det
+    xty[:d] = det.T @ y
+    for i in range(1, p + 1):
+        rows = slice(d + (i - 1) * k, d + i * k)
+        xtx[:d, rows] = det.T @ mat[start - i : n - i]
+        xtx[rows, :d] = xtx[:d, rows].T
+        xty[rows] = autocross[i].T
+        for j in range(i, p + 1):
+            h = j - i
+            cols = slice(d + (j - 1) * k, d + j * k)
+            xtx[rows, cols] = (
+                autocross[h]
+                + mat[start - i : start].T @ mat[start - i - h : start - h]
+                - mat[n - i : n].T @ mat[n - i - h : n - h]
+            )
+            xtx[cols, rows] = xtx[rows, cols].T
+    return xtx, xty, autocross[0]
+
+
+def solve_normal_equations(xtx, xty):
+    """ Solve X'X B = X'Y with a Cholesky factorisation, falling back to a
+    least-squares solve if X'X is singular.
+    """
+    try:
+        return linalg.cho_solve(linalg.cho_factor(xtx), xty)
+    except linalg.LinAlgError:
+        return np.linalg.lstsq(xtx, xty, rcond=None)[0]
+
+
+def info_criteria(logdet_sigma_mle, n_sample, k, p, d):
+    """ Information criteria of a VAR(p), as statsmodels VARResults.info_criteria.
+
+    Args:
+        logdet_sigma_mle (float): Log determinant of the ML residual covariance.
+        n_sample (int): Number of observations used in estimation.
+        k (int): Number of variables.
+        p (int): Lag order.
+        d (int): Number of deterministic terms.
+
+    Returns:
+        dict: aic / bic / hqic / fpe.
+    """
+    free_params = p * k ** 2 + k * d
+    df_model = k * p + d
+    return {
+        "aic": logdet_sigma_mle + 2.0 / n_sample * free_params,
+        "bic": logdet_sigma_mle + np.log(n_sample) / n_sample * free_params,
+        "hqic": logdet_sigma_mle + 2.0 * np.log(np.log(n_sample)) / n_sample * free_params,
+        "fpe": ((n_sample + df_model) / (n_sample - df_model)) ** k * np.exp(logdet_sigma_mle),
+    }
+
+
+def companion_matrix(lag_coefs):
+    """ Companion matrix of the VAR(p) lag coefficients.
+
+    Args:
+        lag_coefs (numpy.ndarray): (..., p, k, k) coefficients A_1, ..., A_p, with
+            A_i[response, variable].
+
+    Returns:
+        numpy.ndarray: (..., k * p, k * p) companion matrix.
+    """
+    *batch, p, k, _ = lag_coefs.shape
+    comp = np.zeros((*batch, k * p, k * p))
+    comp[..., :k, :] = lag_coefs.swapaxes(-3, -2).reshape(*batch, k, k * p)
+    comp[..., k:, : k * (p - 1)] = np.eye(k * (p - 1))
+    return comp
+
+
+def ma_matrices(lag_coefs, periods):
+    """ MA representation Phi_0, ..., Phi_periods of a VAR(p).
+
+    Phi_h is the top-left (k, k) block of the h-th power of the companion matrix.
+    Only the first k columns of the power are carried from one horizon to the
+    next, and a leading batch of models is propagated at once. For p = 0, every
+    Phi_h after Phi_0 is zero.
+
+    Args:
+        lag_coefs (numpy.ndarray): (..., p, k, k) lag coefficients, see companion_matrix.
+        periods (int): Last horizon.
+
+    Returns:
+        numpy.ndarray: (..., periods + 1, k, k) MA coefficients.
+    """
+    *batch, p, k, _ = lag_coefs.shape
+    phis = np.zeros((*batch, periods + 1, k, k))
+    phis[..., 0, :, :] = np.eye(k)
+    if not p:  # A VAR(0) has no response after impact.
+        return phis
+    comp = companion_matrix(lag_coefs)
+    power = np.zeros((*batch, k * p, k))
+    power[..., :k, :] = np.eye(k)
+    for h in range(1, periods + 1):
+        power = comp @ power
+        phis[..., h, :, :] = power[..., :k, :]
+    return phis
+
+
+def fevd_from_irf(orth_irfs, periods):
+    """ Forecast error variance decomposition from orthogonalised impulse responses.
+
+    Args:
+        orth_irfs (numpy.ndarray): (..., >= periods, k, k) responses [horizon,
+            response, shock].
+        periods (int): Number of horizons.
+
+    Returns:
+        numpy.ndarray: (..., k, periods, k) shares [variable, horizon, shock], as
+            statsmodels FEVD.decomp.
+    """
+    cum = np.cumsum(orth_irfs[..., :periods, :, :] ** 2, axis=-3)
+    return (cum / cum.sum(axis=-1, keepdims=True)).swapaxes(-3, -2)
+
+
+def _bootstrap_irf_chunk(data, params, resid, p, reg_type, periods, orth, method, n_reps, seed):
+    """ Impulse responses of n_reps bootstrap replications, simulated and refitted
+    as batched arrays.
+
+    Args:
+        data (numpy.ndarray): (n, k) data; the first p observations start every
+            replicated sample.
+        params (numpy.ndarray): (d + k * p, k) estimates, see VectorAR._set_estimates.
+        resid (numpy.ndarray): (n - p, k) centred residuals.
+        method (str): residual (resampled with replacement) / wild (Rademacher signs).
+        seed (numpy.random.SeedSequence): Seed of the chunk.
+
+    Returns:
+        numpy.ndarray: (n_reps, periods + 1, k, k) impulse responses.
+    """
+    rng = np.random.default_rng(seed)
+    n_obs, k = data.shape
+    n_sample = n_obs - p
+    det = deterministic_matrix(p, n_obs, reg_type)
+    d = det.shape[1]
+    if method == "residual":
+        shocks = resid[rng.integers(0, n_sample, size=(n_reps, n_sample))]
+    else:
+        shocks = resid * rng.choice([-1.0, 1.0], size=(n_reps, n_sample, 1))
+
+    # Replicated samples, one recursion step for all replications at once.
+    sims = np.empty((n_reps, n_obs, k))
+    sims[:, :p] = data[:p]
+    sims[:, p:] = det @ params[:d] + shocks
+    for t in range(p, n_obs):
+        sims[:, t] += sims[:, t - p : t][:, ::-1].reshape(n_reps, -1) @ params[d:]
+
+    x = np.concatenate((np.broadcast_to(det, (n_reps, n_sample, d)), lag_matrix(sims, p)), axis=2)
+    y = sims[:, p:]
+    xt = x.swapaxes(1, 2)
+    params_b = np.linalg.solve(xt @ x, xt @ y)
+    lag_coefs = params_b[:, d:].reshape(n_reps, p, k, k).swapaxes(-1, -2)
+    irfs = ma_matrices(lag_coefs, periods)
+    if orth:
+        eps = y - x @ params_b
+        sigma = eps.swapaxes(1, 2) @ eps / (n_sample - d - k * p)
+        irfs = irfs @ np.linalg.cholesky(sigma)[:, None]
+    return irfs
+
+
+def _standardised_moments(xtx, xty, yty, d, n_sample):
+    """ Lag cross products with the deterministic terms partialled out, for
+    regressors and responses scaled to unit variance.
+
+    Returns:
+        tuple: Gram (m, m) and cross (m, k) moments per observation, regressor
+            and response scales, deterministic solve [G_dd^-1 G_dl, G_dd^-1 G_dy].
+    """
+    k = xty.shape[1]
+    gram, cross, resp = xtx[d:, d:], xty[d:], np.diag(yty)
+    det_solve = np.empty((0, xtx.shape[0] - d + k))
+    if d:
+        det_solve = linalg.solve(xtx[:d, :d], np.hstack((xtx[:d, d:], xty[:d])), assume_a="pos")
+        gram = gram - xtx[d:, :d] @ det_solve[:, :-k]
+        cross = cross - xtx[d:, :d] @ det_solve[:, -k:]
+        resp = resp - np.sum(xty[:d] * det_solve[:, -k:], axis=0)
+    x_scale = np.sqrt(np.maximum(np.diag(gram), 0) / n_sample)
+    x_scale[x_scale == 0] = 1.0
+    y_scale = np.sqrt(np.maximum(resp, 0) / n_sample)
+    y_scale[y_scale == 0] = 1.0
+    gram = gram / np.outer(x_scale, x_scale) / n_sample
+    cross = cross / np.outer(x_scale, y_scale) / n_sample
+    return gram, cross, x_scale, y_scale, det_solve
+
+
+def _cd_sweep(gram, grad, diag, coefs, l1, l2):
+    """ One coordinate descent sweep over the rows of coefs, updating coefs and
+    the transposed gradient (C - GB)' in place.
+
+    Only the equations whose coefficient changes update their gradient, as a
+    row is typically non-zero in a few equations only.
+
+    Returns:
+        float: Largest diag(G) * change^2.
+    """
+    max_change = 0.0
+    for j in range(len(coefs)):
+        rho = grad[:, j] + diag[j] * coefs[j]
+        new = np.maximum(np.abs(rho) - l1, 0)
+        new *= np.sign(rho) / (diag[j] + l2)
+        delta = new - coefs[j]
+        changed = np.flatnonzero(delta)
+        if len(changed):
+            step = delta[changed]
+            grad[changed] -= step[:, None] * gram[j]
+            coefs[j] = new
+            max_change = max(max_change, diag[j] * np.max(step ** 2))
+    return max_change
+
+
+def _cd_solve(gram, cross, diag, coefs, l1, l2, tol, max_iter):
+    """ Coordinate descent until a full sweep over the rows converges. After each
+    full sweep, further sweeps run over the active (non-zero) rows only, on
+    their own Gram sub-matrix.
+
+    Returns:
+        int: Number of sweeps.
+    """
+    n_iter = 0
+    while n_iter < max_iter:
+        active = np.flatnonzero(coefs.any(axis=1))
+        grad = (cross - gram[:, active] @ coefs[active]).T.copy()
+        n_iter += 1
+        if _cd_sweep(gram, grad, diag, coefs, l1, l2) < tol:
+            break
+        active = np.flatnonzero(coefs.any(axis=1))
+        sub_gram, sub_coefs = gram[np.ix_(active, active)], coefs[active]
+        sub_grad = (cross[active] - sub_gram @ sub_coefs).T.copy()
+        while n_iter < max_iter:
+            n_iter += 1
+            if _cd_sweep(sub_gram, sub_grad, diag[active], sub_coefs, l1, l2) < tol:
+                break
+        coefs[active] = sub_coefs
+    return n_iter
+
+
+def elastic_net_cd(gram, cross, alpha, l1_ratio, coefs, tol=1e-7, max_iter=1000, prev_alpha=None):
+    """ Elastic net by coordinate descent on cross products, all equations at once:
+
+        min_B  tr(B'GB) / 2 - tr(C'B) + alpha * (l1_ratio * |B|_1 + (1 - l1_ratio) / 2 * |B|^2)
+
+    The equations share the Gram matrix, so each coordinate update is done for
+    the k equations together. A full sweep over every row is followed by sweeps
+    over the active (non-zero) rows only, until a full sweep changes nothing. As
+    glmnet, a sweep has converged when no update changes the fitted values by
+    more than tol, i.e. diag(G) * change^2 < tol for standardised responses.
+
+    On a path, the sequential strong rule (Tibshirani et al., 2012) screens out
+    the zero rows whose gradient at the previous solution is below
+    l1_ratio * (2 * alpha - prev_alpha) in every equation. Coordinate descent
+    runs on the remaining rows, and the screened rows are then checked against
+    the optimality conditions; violators are added back until none is left.
+
+    Args:
+        gram (numpy.ndarray): (m, m) Gram matrix per observation.
+        cross (numpy.ndarray): (m, k) cross products per observation.
+        alpha (float): Penalty.
+        l1_ratio (float): Share of the L1 penalty, 1 for the lasso.
+        coefs (numpy.ndarray): (m, k) warm start, updated in place.
+        tol (float, optional): Convergence threshold. Defaults to 1e-7.
+        max_iter (int, optional): Maximum number of sweeps. Defaults to 1000.
+        prev_alpha (float, optional): Penalty of the warm start, for screening.
+            Defaults to None, no screening.
+
+    Returns:
+        numpy.ndarray: (m, k) coefficients.
+    """
+    l1, l2 = alpha * l1_ratio, alpha * (1 - l1_ratio)
+    diag = np.diag(gram)
+    active = coefs.any(axis=1)
+    if prev_alpha is None:
+        rows = np.arange(len(coefs))
+    else:
+        grad = cross - gram[:, active] @ coefs[active]
+        threshold = l1_ratio * (2 * alpha - prev_alpha)
+        rows = np.flatnonzero(active | (np.abs(grad) >= threshold).any(axis=1))
+
+    n_iter = 0
+    while n_iter < max_iter:
+        sub_coefs = coefs[rows]
+        n_iter += _cd_solve(
+            gram[np.ix_(rows, rows)], cross[rows], diag[rows], sub_coefs, l1, l2, tol, max_iter - n_iter
+        )
+        coefs[rows] = sub_coefs
+        # Optimality of the screened rows, which are all zero.
+        rest = np.setdiff1d(np.arange(len(coefs)), rows)
+        active = np.flatnonzero(coefs.any(axis=1))
+        grad = cross[rest] - gram[np.ix_(rest, active)] @ coefs[active]
+        violators = rest[(np.abs(grad) > l1).any(axis=1)]
+        if not len(violators):
+            break
+        rows = np.union1d(rows, violators)
+    return coefs
+
+
+def _histogram_update(counts, values, low, width):
+    """ Add a chunk of draws to fixed-bin counts.
+
+    Args:
+        counts (numpy.ndarray): (n_cols, n_bins + 2) counts, with an underflow
+            and an overflow bin, updated in place.
+        values (numpy.ndarray): (n_draws, n_cols) draws.
+        low, width (numpy.ndarray): (n_cols,) lower edge and bin width.
+    """
+    n_cols, n_bins = counts.shape[0], counts.shape[1] - 2
+    bins = np.clip(np.floor((values - low) / width) + 1, 0, n_bins + 1).astype(np.intp)
+    bins += np.arange(n_cols) * (n_bins + 2)
+    counts += np.bincount(bins.ravel(), minlength=counts.size).reshape(counts.shape)
+
+
+def _histogram_quantile(counts, low, width, v_min, v_max, q):
+    """ Quantile q of fixed-bin counts, interpolated linearly within a bin.
+
+    The underflow and overflow bins span from the bin range to the smallest and
+    largest draws.
+
+    Returns:
+        numpy.ndarray: (n_cols,) quantiles.
+    """
+    n_bins = counts.shape[1] - 2
+    edges = low[:, None] + width[:, None] * np.arange(n_bins + 1)
+    edges = np.column_stack((np.minimum(v_min, low), edges, np.maximum(v_max, edges[:, -1])))
+    cdf = np.column_stack((np.zeros(len(counts)), np.cumsum(counts, axis=1))) / counts.sum(axis=1, keepdims=True)
+    values = np.array([np.interp(q, cdf[i], edges[i]) for i in range(len(counts))])
+    return np.clip(values, v_min, v_max)
+
+
+def _shift_trend(det_params, shift):
+    """ Deterministic coefficients for a trend counted 'shift' observations later,
+    i.e. t' = t - shift, with the same fitted values.
+    """
+    det_params = det_params.copy()
+    if len(det_params) == 3:
+        det_params[0] += det_params[1] * shift + det_params[2] * shift ** 2
+        det_params[1] += 2 * det_params[2] * shift
+    elif len(det_params) == 2:
+        det_params[0] += det_params[1] * shift
+    return det_params
+
+
 class VectorAR:
-    def __init__(self, data, p, exog_names, reg_type="const", intercept=True):
+    def __init__(self, data, p, exog_names=None, reg_type="const", intercept=True, keep_data=True):
+        """
+
+        Args:
+            data (numpy.ndarray, pandas.DataFrame): (n, k) time-series.
+            p (int): Lag order.
+            exog_names (list, optional): Variable names. Defaults to None, the
+                dataframe columns or y1, ..., yk.
+            reg_type (str, optional): Deterministic terms: n / c (const) / ct / ctt.
+                Defaults to "const".
+            intercept (bool, optional): Include deterministic terms; False is the
+                same as reg_type "n". Defaults to True.
+            keep_data (bool, optional): Keep a copy of the data in 'orig_data'. If
+                False, the model refers to the input array without copying it.
+                Defaults to True.
+        """
+        reg_type = {"const": "c", "nc": "n"}.get(reg_type, reg_type) if intercept else "n"
+        if reg_type not in DETERMINISTIC_TERMS:
+            raise ValueError("reg_type should be: n / c (const) / ct / ctt.")
+        if exog_names is None:
+            exog_names = (
+                data.columns if isinstance(data, pd.DataFrame) else [f"y{i + 1}" for i in range(data.shape[1])]
+            )
+
         self.p = p
-        self.intercept = True
-        self.reg_type = "const"
-        self.exog_names = exog_names
+        self.reg_type = reg_type
+        self.intercept = "c" in reg_type
+        self.det_names = DETERMINISTIC_TERMS[reg_type]
+        self.exog_names = list(exog_names)
 
-        self.orig_data = data.copy()
+        self.index = data.index if isinstance(data, pd.DataFrame) else None
+        self.date_freq = get_date_freq(data) if isinstance(data, pd.DataFrame) else None
+        data = np.asarray(data, dtype=float)
+        self.orig_data = data.copy() if keep_data else None
+        self.data = self.orig_data if keep_data else data
         self.n_obs, self.k = data.shape
         self.n_sample = self.n_obs - p
-        self.y_dep = data[p:]
-        self.y_exog = design_matrix(lag_matrix(data, p))
+        self.y_dep = self.data[p:]
+
+    def __repr__(self):
+        return f"VectorAR: k={self.k} / p={self.p} / Deterministic: {self.reg_type} / Obs: {self.n_obs}"
+
+    @property
+    def y_exog(self):
+        """ (n_sample, k * p + d) design matrix, lags first then deterministic terms.
+        """
+        det = deterministic_matrix(self.p, self.n_obs, self.reg_type)
+        return np.hstack((lag_matrix(self.data, self.p), det))
 
     def _format_coefs(self):
-        col_names = [self.exog_names + f"l{lag+1}" for lag in range(p)]
-        if self.intercept:
-            col_names = [*self.exog_names, "Intercept"]
-        else:
-            col_names = self.exog_names
+        col_names = [f"L{lag + 1}.{name}" for lag in range(self.p) for name in self.exog_names]
+        col_names += self.det_names
         return pd.DataFrame(self.coefs, columns=col_names, index=self.exog_names)
-        
-    def fit(self):
-        Y = self.y_dep.T
-        X = self.y_exog.T
-        self.coefs = (Y @ X.T) @ np.linalg.inv(X @ X.T)
-        self.eps = Y - self.coefs @ X
-        self.dof = self.n_obs - self.p - self.p * self.k - self.intercept
-        self.sigma = (self.eps@ self.eps.T)/ self.dof
-        
+
+    def _set_estimates(self, params):
+        """ Store estimates from the (d + k * p, k) solution in regressor order
+        [deterministic terms, lags], see cross_products.
+        """
+        d = len(self.det_names)
+        self.params = params
+        self.coefs = np.vstack((params[d:], params[:d])).T
+        self.eps = self.residuals(params)
+        self.dof = self.n_obs - self.p - self.p * self.k - d
+        self.sigma = (self.eps @ self.eps.T) / self.dof
+
+    def residuals(self, params=None):
+        """ (k, n_sample) residuals, computed lag block by lag block.
+        """
+        params = self.params if params is None else params
+        d = len(self.det_names)
+        eps = self.y_dep - deterministic_matrix(self.p, self.n_obs, self.reg_type) @ params[:d]
+        for lag in range(1, self.p + 1):
+            block = params[d + (lag - 1) * self.k : d + lag * self.k]
+            eps -= self.data[self.p - lag : self.n_obs - lag] @ block
+        return eps.T
+
+    def fit(self, method="cholesky"):
+        """ OLS estimation equation by equation.
+
+        Args:
+            method (str, optional): cholesky (normal equations built from lag
+                blocks, no design matrix) / qr (QR factorisation of the design
+                matrix, for ill-conditioned data). Defaults to "cholesky".
+
+        Returns:
+            VectorAR: self
+        """
+        if method == "cholesky":
+            xtx, xty, _ = cross_products(self.data, self.p, self.reg_type)
+            params = solve_normal_equations(xtx, xty)
+        elif method == "qr":
+            d = len(self.det_names)
+            x = self.y_exog
+            x = np.hstack((x[:, x.shape[1] - d :], x[:, : x.shape[1] - d]))
+            q, r = np.linalg.qr(x)
+            params = linalg.solve_triangular(r, q.T @ self.y_dep)
+        else:
+            raise ValueError("Estimation method should be: cholesky / qr.")
+        self._set_estimates(params)
+        return self
+
     def summary(self):
         return self._format_coefs()
-    
 
-a = VectorAR(df_mat, exog_names=df.columns, p=1)
-a.fit()
-a.summary()
+    @property
+    def info_criteria(self):
+        """ Information criteria of the fitted model, see info_criteria.
+        """
+        d = len(self.det_names)
+        logdet = np.linalg.slogdet(self.eps @ self.eps.T / self.n_sample)[1]
+        return info_criteria(logdet, self.n_sample, self.k, self.p, d)
+
+    def fit_rolling(self, window=None, min_obs=None, refresh=100):
+        """ Re-estimate the model on every rolling or expanding window end.
+
+        Coefficients and residual cross products are updated by recursive least
+        squares, a rank-one update for the observation entering the window and a
+        rank-one downdate for the one leaving it, at O(m^2) per step instead of a
+        full re-estimation. The exact cross products are also tracked, and the
+        solution is refactorised from them every 'refresh' steps to bound
+        rounding drift.
+
+        Args:
+            window (int, optional): Rolling window length in regression
+                observations. Defaults to None, an expanding window.
+            min_obs (int, optional): First window length for an expanding window.
+                Defaults to None, twice the number of regressors.
+            refresh (int, optional): Steps between refactorisations. Defaults to 100.
+
+        Returns:
+            dict: Paths per window end:
+                * end: Last observation of the window (index label or position).
+                * coefs: (n_windows, k, k * p + d) coefficients, see 'coefs',
+                  as fitted on the window alone.
+                * sigma: (n_windows, k, k) residual covariance.
+                * aic / bic / hqic / fpe: (n_windows,) information criteria.
+        """
+        d = len(self.det_names)
+        m = d + self.k * self.p
+        x = self.y_exog
+        x = np.hstack((x[:, m - d :], x[:, : m - d]))  # Regressor order [det, lags].
+        y = self.y_dep
+        first = window if window is not None else (min_obs or 2 * m)
+        if first <= m or first > self.n_sample:
+            raise ValueError(f"The first window should have {m + 1} to {self.n_sample} observations.")
+
+        def factorise(xtx, xty, yty):
+            p_mat = linalg.cho_solve(linalg.cho_factor(xtx), np.eye(m))
+            params = p_mat @ xty
+            return p_mat, params, yty - xty.T @ params
+
+        xtx, xty, yty = x[:first].T @ x[:first], x[:first].T @ y[:first], y[:first].T @ y[:first]
+        p_mat, params, ssr = factorise(xtx, xty, yty)
+
+        n_windows = self.n_sample - first + 1
+        coefs = np.empty((n_windows, self.k, m))
+        sigma = np.empty((n_windows, self.k, self.k))
+        ics = {ic: np.empty(n_windows) for ic in ["aic", "bic", "hqic", "fpe"]}
+        for step in range(n_windows):
+            end = first + step  # Window covers regression rows [end - n, end).
+            if step:
+                updates = [(end - 1, 1.0)] + ([(end - 1 - window, -1.0)] if window else [])
+                for row, sign in updates:
+                    xt, yt = x[row], y[row]
+                    xtx += sign * np.outer(xt, xt)
+                    xty += sign * np.outer(xt, yt)
+                    yty += sign * np.outer(yt, yt)
+                    px = p_mat @ xt
+                    denom = 1.0 + sign * xt @ px
+                    err = yt - params.T @ xt
+                    params += sign * np.outer(px, err) / denom
+                    p_mat -= sign * np.outer(px, px) / denom
+                    ssr += sign * np.outer(err, err) / denom
+                if step % refresh == 0:
+                    p_mat, params, ssr = factorise(xtx, xty, yty)
+
+            n_window = window or end
+            # The trend of a rolling window is counted from its own start, as
+            # in a fit on the window.
+            det_params = _shift_trend(params[:d], end - n_window)
+            coefs[step] = np.vstack((params[d:], det_params)).T
+            sigma[step] = ssr / (n_window - m)
+            logdet = np.linalg.slogdet(ssr / n_window)[1]
+            for ic, value in info_criteria(logdet, n_window, self.k, self.p, d).items():
+                ics[ic][step] = value
+
+        ends = np.arange(self.p + first - 1, self.n_obs)
+        return {
+            "end": self.index[ends] if self.index is not None else ends,
+            "coefs": coefs,
+            "sigma": sigma,
+            **ics,
+        }
+
+    @property
+    def lag_coefs(self):
+        """ (p, k, k) lag coefficients A_1, ..., A_p, A_i[response, variable].
+        """
+        d = len(self.det_names)
+        return self.params[d:].reshape(self.p, self.k, self.k).swapaxes(1, 2)
+
+    def irf(self, periods=10, orth=False):
+        """ Impulse responses, as statsmodels IRAnalysis irfs / orth_irfs.
+
+        Args:
+            periods (int, optional): Last horizon. Defaults to 10.
+            orth (bool, optional): Responses to Cholesky orthogonalised shocks.
+                Defaults to False.
+
+        Returns:
+            numpy.ndarray: (periods + 1, k, k) responses [horizon, response, shock].
+        """
+        irfs = ma_matrices(self.lag_coefs, periods)
+        return irfs @ np.linalg.cholesky(self.sigma) if orth else irfs
+
+    def fevd(self, periods=10):
+        """ Forecast error variance decomposition, as statsmodels FEVD.decomp.
+
+        Args:
+            periods (int, optional): Number of horizons. Defaults to 10.
+
+        Returns:
+            numpy.ndarray: (k, periods, k) shares [variable, horizon, shock].
+        """
+        return fevd_from_irf(self.irf(periods - 1, orth=True), periods)
+
+    def bootstrap_irf(
+        self, periods=10, reps=1000, method="residual", orth=False, signif=0.05, seed=None, n_jobs=None, chunk_size=250
+    ):
+        """ Bootstrap confidence bands of the impulse responses.
+
+        Replicated samples are simulated from the estimates with resampled
+        (residual) or sign-flipped (wild) residuals, and refitted with batched
+        solves, chunk_size replications at a time. Each chunk has its own seed
+        spawned from 'seed', so the bands do not depend on n_jobs.
+
+        Args:
+            periods (int, optional): Last horizon. Defaults to 10.
+            reps (int, optional): Number of replications. Defaults to 1000.
+            method (str, optional): residual / wild. Defaults to "residual".
+            orth (bool, optional): Orthogonalised responses. Defaults to False.
+            signif (float, optional): Significance level of the bands. Defaults to 0.05.
+            seed (int, optional): Random seed. Defaults to None.
+            n_jobs (int, optional): Number of processes. Defaults to None, no pool.
+            chunk_size (int, optional): Replications per chunk. Defaults to 250.
+
+        Returns:
+            dict: irf (point estimates), lower and upper bands, each
+                (periods + 1, k, k) [horizon, response, shock].
+        """
+        if method not in ["residual", "wild"]:
+            raise ValueError("Bootstrap method should be: residual / wild.")
+        sizes = [min(chunk_size, reps - start) for start in range(0, reps, chunk_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        resid = self.eps.T - self.eps.mean(axis=1)
+        args = (self.data, self.params, resid, self.p, self.reg_type, periods, orth, method)
+        if n_jobs:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                chunks = list(pool.map(_bootstrap_irf_chunk, *(repeat(arg) for arg in args), sizes, seeds))
+        else:
+            chunks = [_bootstrap_irf_chunk(*args, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+        lower, upper = np.quantile(np.concatenate(chunks), [signif / 2, 1 - signif / 2], axis=0)
+        return {"irf": self.irf(periods, orth), "lower": lower, "upper": upper}
+
+    def _forecast_index(self, horizon):
+        """ Dates of the forecast horizons, or 1, ..., horizon without a regular
+        date index.
+
+        The date frequency is read as api_connect.frequency.get_date_freq does, on
+        the input data. m / q / y horizons are labelled by period end or start,
+        as the last observation.
+        """
+        if isinstance(self.index, pd.DatetimeIndex) and len(self.index):
+            last = self.index[-1]
+            if self.date_freq in N_MONTH:
+                periods = pd.period_range(pd.Period(last, self.date_freq) + 1, periods=horizon)
+                how = "end" if last == period_end(last, self.date_freq) else "start"
+                return pd.DatetimeIndex(periods.to_timestamp(how=how).normalize())
+            freq = self.index.freq or (pd.infer_freq(self.index) if len(self.index) >= 3 else None)
+            if freq is not None:
+                return pd.date_range(last, periods=horizon + 1, freq=freq)[1:]
+        return pd.RangeIndex(1, horizon + 1, name="h")
+
+    def forecast(self, horizon):
+        """ Point forecasts from the end of the sample.
+
+        Args:
+            horizon (int): Number of steps ahead.
+
+        Returns:
+            pandas.DataFrame: (horizon, k) forecasts.
+        """
+        return self.simulate(horizon, n_paths=1, zero_shocks=True)["mean"]
+
+    def simulate(
+        self,
+        horizon,
+        n_paths=10000,
+        conditions=None,
+        quantiles=(0.05, 0.5, 0.95),
+        chunk_size=10000,
+        n_bins=2000,
+        seed=None,
+        zero_shocks=False,
+    ):
+        """ Monte Carlo simulation of forecast paths from the end of the sample.
+
+        Shocks are drawn from N(0, sigma) and all paths of a chunk are propagated
+        at once as a (paths, horizon, k) array. Conditioned variables follow their
+        given path exactly: at each step the shocks of the conditioned variables
+        are set to hit the path, and the other shocks are drawn from their normal
+        distribution conditional on them.
+
+        Paths are generated chunk_size at a time. Each chunk is added to running
+        sums and to n_bins fixed-bin counts per horizon and variable, and
+        dropped, so memory does not grow with n_paths. The bins span the range of
+        the first chunk, widened by half of it on each side; draws outside it
+        are counted in two overflow bins that extend to the smallest and largest
+        draws. A quantile inside the bin range is within one bin width of the
+        sample quantile of all paths, whatever chunk_size.
+
+        Args:
+            horizon (int): Number of steps ahead.
+            n_paths (int, optional): Number of paths. Defaults to 10000.
+            conditions (dict, pandas.DataFrame, optional): Path per conditioned
+                variable (name or position), of length horizon; NaN leaves a step
+                unconditioned. Defaults to None.
+            quantiles (tuple, optional): Reported quantiles. Defaults to (0.05, 0.5, 0.95).
+            chunk_size (int, optional): Paths per chunk. Defaults to 10000.
+            n_bins (int, optional): Number of bins per horizon and variable.
+                Defaults to 2000.
+            seed (int, optional): Random seed. Defaults to None.
+            zero_shocks (bool, optional): Propagate without shocks, i.e. point
+                forecasts. Defaults to False.
+
+        Returns:
+            dict: mean and one entry per quantile, each a (horizon, k) pandas.DataFrame.
+        """
+        k, p, d = self.k, self.p, len(self.det_names)
+        targets = np.full((horizon, k), np.nan)
+        for name, path in (conditions if conditions is not None else {}).items():
+            col = self.exog_names.index(name) if name in self.exog_names else name
+            targets[:, col] = np.asarray(path, dtype=float)[:horizon]
+
+        # Shock transforms per distinct set of conditioned variables.
+        chol = np.linalg.cholesky(self.sigma)
+        transforms = {}
+        for fixed in np.unique(~np.isnan(targets), axis=0):
+            fixed_idx, free_idx = np.flatnonzero(fixed), np.flatnonzero(~fixed)
+            if not len(fixed_idx):
+                transforms[fixed.tobytes()] = (fixed_idx, free_idx, None, chol)
+                continue
+            sigma_cc = self.sigma[np.ix_(fixed_idx, fixed_idx)]
+            sigma_uc = self.sigma[np.ix_(free_idx, fixed_idx)]
+            gain = linalg.solve(sigma_cc, sigma_uc.T, assume_a="pos").T
+            cond_sigma = self.sigma[np.ix_(free_idx, free_idx)] - gain @ sigma_uc.T
+            cond_chol = np.linalg.cholesky(cond_sigma) if len(free_idx) else None
+            transforms[fixed.tobytes()] = (fixed_idx, free_idx, gain, cond_chol)
+
+        det = deterministic_matrix(self.n_obs, self.n_obs + horizon, self.reg_type) @ self.params[:d]
+        rng = np.random.default_rng(seed)
+        total, n_done = np.zeros((horizon, k)), 0
+        counts = np.zeros((horizon * k, n_bins + 2), dtype=np.int64)
+        while n_done < n_paths:
+            n_chunk = min(chunk_size, n_paths - n_done)
+            paths = np.empty((n_chunk, p + horizon, k))
+            paths[:, :p] = self.data[-p:] if p else 0
+            for h in range(horizon):
+                mean = det[h] + paths[:, h : h + p][:, ::-1].reshape(n_chunk, -1) @ self.params[d:]
+                fixed_idx, free_idx, gain, shock_chol = transforms[(~np.isnan(targets[h])).tobytes()]
+                shocks = np.zeros((n_chunk, k))
+                if len(fixed_idx):
+                    shocks[:, fixed_idx] = targets[h, fixed_idx] - mean[:, fixed_idx]
+                    if len(free_idx):
+                        shocks[:, free_idx] = shocks[:, fixed_idx] @ gain.T
+                if not zero_shocks and shock_chol is not None:
+                    shocks[:, free_idx] += rng.standard_normal((n_chunk, len(free_idx))) @ shock_chol.T
+                paths[:, p + h] = mean + shocks
+
+            paths = paths[:, p:].reshape(n_chunk, -1)
+            total += paths.sum(axis=0).reshape(horizon, k)
+            chunk_min, chunk_max = paths.min(axis=0), paths.max(axis=0)
+            if not n_done:
+                span = chunk_max - chunk_min
+                span = np.maximum(span, 1e-9 * np.maximum(np.abs(chunk_max), 1.0))
+                low, width = chunk_min - span / 2, 2 * span / n_bins
+                v_min, v_max = chunk_min, chunk_max
+            v_min, v_max = np.minimum(v_min, chunk_min), np.maximum(v_max, chunk_max)
+            _histogram_update(counts, paths, low, width)
+            n_done += n_chunk
+
+        index = self._forecast_index(horizon)
+        output = {"mean": pd.DataFrame(total / n_paths, index=index, columns=self.exog_names)}
+        for q in quantiles:
+            values = _histogram_quantile(counts, low, width, v_min, v_max, q).reshape(horizon, k)
+            output[q] = pd.DataFrame(values, index=index, columns=self.exog_names)
+        return output
+
+    def regularization_path(
+        self,
+        penalty="lasso",
+        alphas=None,
+        n_alphas=20,
+        alpha_min_ratio=1e-2,
+        alpha_min=None,
+        l1_ratio=0.5,
+        tol=1e-7,
+        max_iter=1000,
+    ):
+        """ Penalised estimates over a decreasing sequence of penalties.
+
+        Lag coefficients are penalised on standardised regressors and responses;
+        deterministic terms are not penalised. X'X and X'Y come from
+        cross_products, which never builds the lag matrix. Ridge estimates of the
+        whole path come from one eigendecomposition of the Gram matrix; lasso and
+        elastic net estimates by coordinate descent, each penalty warm-started
+        from the previous one and screened by the strong rule, see elastic_net_cd.
+
+        Args:
+            penalty (str, optional): ridge / lasso / elasticnet. Defaults to "lasso".
+            alphas (list, optional): Penalties. Defaults to None, n_alphas values
+                from the smallest penalty setting every lag coefficient to zero
+                (1 for ridge) down to alpha_min_ratio times it.
+            n_alphas (int, optional): Number of penalties. Defaults to 20.
+            alpha_min_ratio (float, optional): Smallest / largest penalty. Defaults to 1e-2.
+            alpha_min (float, optional): Smallest penalty, instead of alpha_min_ratio.
+                Defaults to None.
+            l1_ratio (float, optional): Share of the L1 penalty for elasticnet.
+                Defaults to 0.5.
+            tol (float, optional): Coordinate descent tolerance, see elastic_net_cd.
+                Defaults to 1e-7.
+            max_iter (int, optional): Maximum coordinate descent sweeps. Defaults to 1000.
+
+        Returns:
+            dict: Per penalty:
+                * alphas: (n_alphas,) penalties, decreasing.
+                * coefs: (n_alphas, k, k * p + d) coefficients, see 'coefs'.
+                * n_nonzero: (n_alphas,) number of non-zero lag coefficients.
+                * params: (n_alphas, d + k * p, k) estimates, see _set_estimates.
+        """
+        if penalty not in ["ridge", "lasso", "elasticnet"]:
+            raise ValueError("penalty should be: ridge / lasso / elasticnet.")
+        l1_ratio = {"ridge": 0.0, "lasso": 1.0}.get(penalty, l1_ratio)
+        d = len(self.det_names)
+        xtx, xty, yty = cross_products(self.data, self.p, self.reg_type)
+        gram, cross, x_scale, y_scale, det_solve = _standardised_moments(xtx, xty, yty, d, self.n_sample)
+
+        if alphas is None:
+            alpha_max = np.abs(cross).max() / l1_ratio if l1_ratio else 1.0
+            alpha_min = alpha_min if alpha_min is not None else alpha_max * alpha_min_ratio
+            alphas = np.geomspace(max(alpha_max, alpha_min), alpha_min, n_alphas)
+        alphas = np.sort(np.asarray(alphas, dtype=float))[::-1]
+
+        if not l1_ratio:
+            eigvals, eigvecs = np.linalg.eigh(gram)
+            rotated = eigvecs.T @ cross
+        lag_coefs = np.zeros_like(cross)
+        params = np.empty((len(alphas), xtx.shape[0], self.k))
+        for i, alpha in enumerate(alphas):
+            if l1_ratio:
+                prev_alpha = alphas[i - 1] if i else None
+                lag_coefs = elastic_net_cd(gram, cross, alpha, l1_ratio, lag_coefs, tol, max_iter, prev_alpha)
+            else:
+                lag_coefs = eigvecs @ (rotated / (eigvals + alpha)[:, None])
+            params[i, d:] = lag_coefs * y_scale[None, :] / x_scale[:, None]
+            params[i, :d] = det_solve[:, -self.k :] - det_solve[:, : -self.k] @ params[i, d:]
+
+        return {
+            "alphas": alphas,
+            "coefs": np.concatenate((params[:, d:], params[:, :d]), axis=1).swapaxes(1, 2),
+            "n_nonzero": np.count_nonzero(params[:, d:], axis=(1, 2)),
+            "params": params,
+        }
+
+    def fit_regularized(self, alpha, penalty="ridge", l1_ratio=0.5, n_alphas=10, tol=1e-7, max_iter=1000):
+        """ Penalised estimation, see regularization_path.
+
+        Lasso and elastic net estimates are reached along a warm-started path of
+        n_alphas penalties ending at alpha.
+
+        Args:
+            alpha (float): Penalty.
+            penalty (str, optional): ridge / lasso / elasticnet. Defaults to "ridge".
+            l1_ratio (float, optional): Share of the L1 penalty for elasticnet.
+                Defaults to 0.5.
+            n_alphas (int, optional): Number of penalties on the path. Defaults to 10.
+
+        Returns:
+            VectorAR: self
+        """
+        path = self.regularization_path(
+            penalty,
+            alphas=[alpha] if penalty == "ridge" else None,
+            n_alphas=n_alphas,
+            alpha_min=alpha,
+            l1_ratio=l1_ratio,
+            tol=tol,
+            max_iter=max_iter,
+        )
+        self._set_estimates(path["params"][-1])
+        # OLS degrees of freedom do not apply to penalised estimates, and may be
+        # negative for large systems; sigma is the ML estimate.
+        self.dof = self.n_sample
+        self.sigma = (self.eps @ self.eps.T) / self.dof
+        return self
+
+    @classmethod
+    def select_order(cls, data, maxlags, ic="aic", **kwargs):
+        """ Select the lag order by information criterion and fit the best model.
+
+        All lag orders 0 (1 without deterministic terms), ..., maxlags are compared
+        on the common sample that starts after maxlags observations, as statsmodels
+        VAR.select_order. X'X is built and factorised once for maxlags: the
+        Cholesky factor of each smaller model is a leading sub-block of it, so a
+        single triangular solve gives the residual covariance of every lag order.
+
+        Args:
+            data (numpy.ndarray, pandas.DataFrame): (n, k) time-series.
+            maxlags (int): Largest lag order.
+            ic (str, optional): aic / bic / hqic / fpe. Defaults to "aic".
+            **kwargs: VectorAR arguments, e.g. reg_type.
+
+        Returns:
+            tuple(VectorAR, pandas.DataFrame): Best model fitted on the common
+                sample, information criteria per lag order.
+        """
+        if ic not in ["aic", "bic", "hqic", "fpe"]:
+            raise ValueError("ic should be: aic / bic / hqic / fpe.")
+        model = cls(data, maxlags, **kwargs)
+        k, d = model.k, len(model.det_names)
+        n_sample = model.n_obs - maxlags
+        xtx, xty, yty = cross_products(model.data, maxlags, model.reg_type)
+
+        try:
+            chol = linalg.cholesky(xtx, lower=True)
+            z = linalg.solve_triangular(chol, xty, lower=True)
+        except linalg.LinAlgError:
+            chol = None
+
+        # Without deterministic terms, p = 0 has no regressor.
+        lags = range(0 if d else 1, maxlags + 1)
+        rows = []
+        for p in lags:
+            m = d + k * p
+            if chol is not None:
+                ssr = yty - z[:m].T @ z[:m]
+            else:
+                ssr = yty - xty[:m].T @ solve_normal_equations(xtx[:m, :m], xty[:m])
+            logdet = np.linalg.slogdet(ssr / n_sample)[1]
+            rows.append(info_criteria(logdet, n_sample, k, p, d))
+        table = pd.DataFrame(rows, index=pd.Index(lags, name="p"))
+
+        best_p = int(table[ic].idxmin())
+        m = d + k * best_p
+        if chol is not None:
+            params = linalg.solve_triangular(chol[:m, :m].T, z[:m], lower=False)
+        else:
+            params = solve_normal_equations(xtx[:m, :m], xty[:m])
+        # The best model is estimated on the common sample; its own trend is
+        # counted from the start of that sample.
+        params[:d] = _shift_trend(params[:d], maxlags - best_p)
+        best = cls(
+            model.data[maxlags - best_p :],
+            best_p,
+            exog_names=model.exog_names,
+            reg_type=model.reg_type,
+            keep_data=False,
+        )
+        if model.index is not None:
+            best.index = model.index[maxlags - best_p :]
+            best.date_freq = model.date_freq
+        best._set_estimates(params)
+        return best, table
+
+
+# %%
+if __name__ == "__main__":
+    df = pd.read_csv("/Users/anko/Downloads/T8-svar/za_dat1.csv")
+    df_mat = df.to_numpy()
+    a = VectorAR(df_mat, exog_names=df.columns, p=1)
+    a.fit()
+    print(a.summary())
+
 # %%
@@ -1,12 +1,110 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
 import pandas as pd
 import numpy as np
 import statsmodels.api as sm
 from matplotlib import pyplot as plt
 import seaborn as sns
+from scipy import linalg, stats
+from statsmodels.tsa.coint_tables import c_sja, c_sjt
 from statsmodels.tsa.vector_ar.vecm import coint_johansen
 
+from manual_var import cross_products, lag_matrix
+from ts_analysis import moving_grams, window_bounds
+
+
+# Test types of statsmodels grangercausalitytests.
+GRANGER_TESTS = ["ssr_ftest", "ssr_chi2test", "lrtest", "params_ftest"]
+
+
+def _subset_ssr(xtx, xty, yty, idx, responses):
+    """ SSR of the regressions of the responses on regressor subsets, all solved
+    from one Gram matrix.
+
+    Args:
+        idx (numpy.ndarray): (n_models, m) regressor indices per model.
+        responses (numpy.ndarray): (n_models,) response index per model.
+    """
+    gram = xtx[idx[:, :, None], idx[:, None, :]]
+    cross = xty[idx, responses[:, None]]
+    try:
+        coefs = np.linalg.solve(gram, cross[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        coefs = (np.linalg.pinv(gram) @ cross[:, :, None])[:, :, 0]
+    return yty[responses, responses] - np.sum(cross * coefs, axis=1)
+
+
+def _granger_block(data, maxlag, responses):
+    """ Granger causality p-values of every predictor for a block of responses.
+
+    For each lag order, the cross products of [constant, lags of every variable]
+    are built once on the sample of that order; every restricted and unrestricted
+    regression is a regressor subset solved from them.
+
+    Returns:
+        numpy.ndarray: (4, len(responses), k, maxlag) p-values, tests as in
+            GRANGER_TESTS, NaN on the diagonal.
+    """
+    n_obs, k = data.shape
+    responses = np.asarray(responses)
+    pairs = np.arange(k)[None, :] != responses[:, None]
+    pair_resp = np.broadcast_to(responses[:, None], pairs.shape)[pairs]
+    pair_pred = np.broadcast_to(np.arange(k)[None, :], pairs.shape)[pairs]
+    p_values = np.full((4, len(responses), k, maxlag), np.nan)
+    for lag in range(1, maxlag + 1):
+        xtx, xty, yty = cross_products(data, lag, "c")
+        nobs = n_obs - lag
+        lag_cols = 1 + k * np.arange(lag)
+        idx_r = np.column_stack((np.zeros(len(responses), dtype=int), responses[:, None] + lag_cols))
+        idx_u = np.hstack(
+            (np.zeros((len(pair_resp), 1), dtype=int), pair_resp[:, None] + lag_cols, pair_pred[:, None] + lag_cols)
+        )
+        ssr_r = _subset_ssr(xtx, xty, yty, idx_r, responses)
+        ssr_u = _subset_ssr(xtx, xty, yty, idx_u, pair_resp)
+        ssr_r = np.broadcast_to(ssr_r[:, None], pairs.shape)[pairs]
+
+        df_resid = nobs - 2 * lag - 1
+        f_stat = (ssr_r - ssr_u) / ssr_u / lag * df_resid
+        chi2_stat = nobs * (ssr_r - ssr_u) / ssr_u
+        lr_stat = nobs * np.log(ssr_r / ssr_u)
+        f_pvalue = stats.f.sf(f_stat, lag, df_resid)
+        # With OLS covariance, the Wald F-test on the lag coefficients equals the
+        # SSR based F-test.
+        tests = [f_pvalue, stats.chi2.sf(chi2_stat, lag), stats.chi2.sf(lr_stat, lag), f_pvalue]
+        for i, p_value in enumerate(tests):
+            p_values[i, :, :, lag - 1][pairs] = p_value
+    return p_values
+
+
+def granger_causality_tests(df, maxlag, n_jobs=None):
+    """ Granger causality tests of every (response, predictor) pair and lag order,
+    as statsmodels grangercausalitytests run on each pair.
+
+    Args:
+        df (pd.DataFrame): pd.DataFrame containing the time series variables.
+        maxlag (int): Largest lag order; every order 1, ..., maxlag is tested.
+        n_jobs (int, optional): Number of processes, the response variables
+            being split between them. Defaults to None, no pool.
 
-def grangers_causation_matrix(df, test="ssr_chi2test", verbose=False):
+    Returns:
+        dict: p-values per test type (GRANGER_TESTS), each a (k, k, maxlag) array
+            [response, predictor, lag - 1] with NaN on the diagonal.
+    """
+    data = df.to_numpy(dtype=float)
+    responses = np.arange(data.shape[1])
+    if n_jobs:
+        blocks = np.array_split(responses, min(n_jobs, len(responses)))
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            p_values = np.concatenate(
+                list(pool.map(_granger_block, repeat(data), repeat(maxlag), blocks)), axis=1
+            )
+    else:
+        p_values = _granger_block(data, maxlag, responses)
+    return dict(zip(GRANGER_TESTS, p_values))
+
+
+def grangers_causation_matrix(df, maxlag=12, test="ssr_chi2test", verbose=False, n_jobs=None):
     """Check Granger Causality of all possible combinations of the Time series.
     The rows are the response variable, columns are predictors. The values in the table 
     are the P-Values. P-Values lesser than the significance level (0.05), implies 
@@ -17,31 +115,32 @@ def grangers_causation_matrix(df, test="ssr_chi2test", verbose=False):
         If a given p-value is < significance level (0.05), then, the corresponding X series (column) causes the Y (row).
     Args:
         df (pd.DataFrame): pd.DataFrame containing the time series variables.
-        vars (list): list containing names of the time series variables.
-        test (str, optional): Test method. Defaults to 'ssr_chi2test'.
+        maxlag (int, optional): Largest lag order tested. Defaults to 12.
+        test (str, optional): Test method, see GRANGER_TESTS. Defaults to 'ssr_chi2test'.
         verbose (bool, optional): Print results. Defaults to False.
+        n_jobs (int, optional): Number of processes. Defaults to None.
 
     Returns:
-        pd.DataFrame: Granger causality test statistics.
+        pd.DataFrame: Minimum p-value over the lag orders, NaN on the diagonal.
     """
+    if test not in GRANGER_TESTS:
+        raise ValueError(f"test should be one of: {GRANGER_TESTS}.")
     vars = df.columns
-    output = pd.DataFrame(np.zeros((len(vars), len(vars))), columns=vars, index=vars)
-    for c in output.columns:
-        for r in output.index:
-            test_result = sm.tsa.stattools.grangercausalitytests(
-                df[[r, c]], maxlag=maxlag, verbose=False
-            )
-            p_values = [round(test_result[i + 1][0][test][1], 4) for i in range(maxlag)]
-            if verbose:
-                print(f"Y = {r}, X = {c}, P Values = {p_values}")
-            min_p_value = np.min(p_values)
-            output.loc[r, c] = min_p_value
-    output.columns = [var + "_x" for var in vars]
-    output.index = [var + "_y" for var in vars]
+    p_values = np.round(granger_causality_tests(df, maxlag, n_jobs)[test], 4)
+    if verbose:
+        for i, r in enumerate(vars):
+            for j, c in enumerate(vars):
+                if i != j:
+                    print(f"Y = {r}, X = {c}, P Values = {list(p_values[i, j])}")
+    with np.errstate(all="ignore"):
+        min_p_values = np.fmin.reduce(p_values, axis=2)
+    output = pd.DataFrame(min_p_values, columns=vars, index=vars)
+    output.columns = [f"{var}_x" for var in vars]
+    output.index = [f"{var}_y" for var in vars]
     return output
 
 
-def cointegration_test(df: pd.DataFrame, alpha: float = 0.05):
+def cointegration_test(df: pd.DataFrame, alpha: float = 0.05, det_order: int = -1, k_ar_diff: int = 5):
     """ Perform Johanson's Cointegration Test and Report Summary.
 
     Note:
@@ -50,11 +149,14 @@ def cointegration_test(df: pd.DataFrame, alpha: float = 0.05):
     Args:
         df (pd.DataFrame): pd.DataFrame containing the time series variables.
         alpha (float, optional): [description]. Defaults to 0.05.
+        det_order (int, optional): -1 (no deterministic terms) / 0 (constant) /
+            1 (linear trend). Defaults to -1.
+        k_ar_diff (int, optional): Number of lagged differences. Defaults to 5.
 
     Returns:
         pd.DataFrame: Cointegration test statistics.
     """
-    res = coint_johansen(df, -1, 5)
+    res = coint_johansen(df, det_order, k_ar_diff)
     d = {"0.90": 0, "0.95": 1, "0.99": 2}
     traces = res.lr1
     cvts = res.cvt[:, d[str(1 - alpha)]]
@@ -67,6 +169,88 @@ def cointegration_test(df: pd.DataFrame, alpha: float = 0.05):
     return pd.DataFrame(res_dict)
 
 
+def rolling_cointegration_test(df, det_order=-1, k_ar_diff=5, window=None, min_obs=None, refresh=100):
+    """ Johansen trace and maximum eigenvalue statistics on rolling or expanding
+    windows, as coint_johansen run on each window.
+
+    The cross products of [deterministic terms, lagged differences, differences,
+    levels] are updated incrementally as the window moves (see moving_grams).
+    The residual moment matrices of each window are their Schur complements, so
+    a step only solves the k x k generalised eigenproblem.
+
+    Args:
+        df (pd.DataFrame): Time-series; rows with missing values are dropped.
+        det_order (int, optional): -1 / 0 / 1, see cointegration_test. Defaults to -1.
+        k_ar_diff (int, optional): Number of lagged differences. Defaults to 5.
+        window (int, optional): Rolling window length in observations. Defaults
+            to None, an expanding window.
+        min_obs (int, optional): First length of an expanding window, see
+            window_bounds. Defaults to None.
+        refresh (int, optional): Steps between Gram recomputations. Defaults to 100.
+
+    Returns:
+        dict: Paths per window end:
+            * end: Last observation of the window.
+            * eig: (n_windows, k) eigenvalues, descending.
+            * trace / max_eig: (n_windows, k) statistics for rank <= 0, ..., k - 1.
+            * cvt / cvm: (k, 3) 90% / 95% / 99% critical values of the trace and
+              maximum eigenvalue statistics.
+    """
+    if det_order not in [-1, 0, 1]:
+        raise ValueError("det_order should be: -1 / 0 / 1.")
+    df = df.dropna()
+    data = df.to_numpy(dtype=float)
+    n_obs, k = data.shape
+    diff = np.diff(data, axis=0)
+    # Regression row r: differences at t = r + k_ar_diff, levels at r + 1, as
+    # coint_johansen.
+    n_rows = n_obs - 1 - k_ar_diff
+    det = np.ones((n_rows, 1 if det_order > -1 else 0))
+    lags = lag_matrix(diff, k_ar_diff) if k_ar_diff else diff[:0].reshape(n_rows, 0)
+    trend = np.arange(1, n_rows + 1, dtype=float)[:, None][:, : 1 if det_order == 1 else 0]
+    rows = np.hstack((det, lags, diff[k_ar_diff:], data[1 : n_rows + 1], trend))
+    n_z = det.shape[1] + lags.shape[1]
+
+    bounds = window_bounds(n_obs, window, min_obs)
+    row_bounds = [(start, end - k_ar_diff) for start, end in bounds]
+    if row_bounds[0][1] - row_bounds[0][0] <= n_z + k:
+        raise ValueError("The first window is too short for the number of lagged differences.")
+    # Prefix sums for the level trend slope of each window (det_order 1).
+    obs = np.arange(n_obs, dtype=float)
+    sum_y = np.vstack((np.zeros(k), np.cumsum(data, axis=0)))
+    sum_ty = np.vstack((np.zeros(k), np.cumsum(obs[:, None] * data, axis=0)))
+
+    eig = np.empty((len(bounds), k))
+    for step, gram in enumerate(moving_grams(rows, row_bounds, refresh)):
+        moments = gram[n_z:, n_z:]
+        if n_z:
+            moments = moments - gram[n_z:, :n_z] @ linalg.solve(gram[:n_z, :n_z], gram[:n_z, n_z:], assume_a="pos")
+        s00, sl0, sll = moments[:k, :k], moments[k:, :k], moments[k:, k:]
+        if det_order == 1:
+            # Levels are detrended over the window before filtering: l - b * t.
+            start, end = bounds[step]
+            n = end - start + 1
+            t_sum, t2_sum = obs[start : end + 1].sum(), (obs[start : end + 1] ** 2).sum()
+            slope = (sum_ty[end + 1] - sum_ty[start] - t_sum * (sum_y[end + 1] - sum_y[start]) / n) / (
+                t2_sum - t_sum ** 2 / n
+            )
+            detrend = np.vstack((np.eye(k), -slope))
+            sl0, sll = detrend.T @ sl0, detrend.T @ sll @ detrend
+        sig = sl0 @ linalg.solve(s00, sl0.T, assume_a="pos")
+        eig[step] = linalg.eigh(sig, sll, eigvals_only=True)[::-1]
+
+    nobs = np.array([stop - start for start, stop in row_bounds])[:, None]
+    log_eig = np.log(1 - eig)
+    return {
+        "end": df.index[[end for _, end in bounds]],
+        "eig": eig,
+        "trace": -nobs * np.cumsum(log_eig[:, ::-1], axis=1)[:, ::-1],
+        "max_eig": -nobs * log_eig,
+        "cvt": np.array([c_sjt(k - i, det_order) for i in range(k)]),
+        "cvm": np.array([c_sja(k - i, det_order) for i in range(k)]),
+    }
+
+
 class PostModelDiagnostic:
     def __init__(self, results):
         """
@@ -0,0 +1,266 @@
+# %%
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from api_connect.frequency import N_MONTH, get_date_freq
+
+
+def _periods_per_year(data, freq=None):
+    """ Number of periods per year of a time-series.
+
+    The frequency is read from the series metadata (see
+    api_connect.frequency.get_date_freq) and only inferred from the dates for
+    foreign data.
+
+    Args:
+        data (pandas.Series, pandas.DataFrame, numpy.ndarray): Time-series.
+        freq (str, optional): m / q / y. Read from the time-series if None.
+            Defaults to None.
+
+    Raises:
+        TypeError: If the frequency is not given and the input has no date index.
+        ValueError: If the frequency cannot be identified.
+
+    Returns:
+        int: Periods per year.
+    """
+    if freq is None:
+        index = getattr(data, "index", None)
+        if not isinstance(index, (pd.DatetimeIndex, pd.PeriodIndex)):
+            raise TypeError("Please submit the series with datetime index.")
+        freq = get_date_freq(data)
+    if freq not in N_MONTH:
+        raise ValueError("Date frequency of the series should be: m / q / y.")
+    return N_MONTH[freq]
+
+
+# Array kernels: kernel(src, dst, periods) writes the step applied to the 2-D
+# array 'src' into 'dst'. Elementwise kernels may run in place (src is dst).
+def _log_kernel(src, dst, periods):
+    np.log(src, out=dst)
+
+
+def _first_diff_kernel(src, dst, periods):
+    dst[:1] = np.nan
+    np.subtract(src[1:], src[:-1], out=dst[1:])
+
+
+def _yoy_pct_change_kernel(src, dst, periods):
+    dst[:periods] = np.nan
+    np.divide(src[periods:], src[:-periods], out=dst[periods:])
+    dst[periods:] -= 1
+
+
+def _to_array(data):
+    """ 2-D float array of a time-series and the function rebuilding its type.
+    """
+    if isinstance(data, pd.Series):
+        return (
+            data.to_numpy(dtype=float).reshape(-1, 1),
+            lambda arr: pd.Series(arr[:, 0], index=data.index, name=data.name),
+        )
+    if isinstance(data, pd.DataFrame):
+        return (
+            data.to_numpy(dtype=float),
+            lambda arr: pd.DataFrame(arr, index=data.index, columns=data.columns),
+        )
+    arr = np.asarray(data, dtype=float)
+    if arr.ndim == 1:
+        return arr.reshape(-1, 1), lambda arr: arr[:, 0]
+    return arr, lambda arr: arr
+
+
+def _add_suffix(data, suffix):
+    if not suffix:
+        return data
+    if isinstance(data, pd.Series):
+        return data.rename(f"{data.name}{suffix}")
+    if isinstance(data, pd.DataFrame):
+        return data.add_suffix(suffix)
+    return data
+
+
+def _run_fused(data, steps, freq=None):
+    """ Apply consecutive array steps in a single pass.
+
+    At most two work arrays are allocated for the whole run: elementwise steps
+    run in place and shift steps swap between the two arrays.
+
+    Args:
+        data (pandas.Series, pandas.DataFrame, numpy.ndarray): Time-series.
+        steps (list): Functions registered in ARRAY_STEPS.
+        freq (str, optional): m / q / y, see _periods_per_year. Defaults to None.
+
+    Returns:
+        Same type as data: Transformed time-series.
+    """
+    src, rebuild = _to_array(data)
+    kernels = [ARRAY_STEPS[func] for func in steps]
+    periods = (
+        _periods_per_year(data, freq)
+        if any(kind == "shift" and needs_freq for _, kind, needs_freq, _ in kernels)
+        else None
+    )
+    buffers = [np.empty_like(src), None]
+    for kernel, kind, _, _ in kernels:
+        if kind == "elementwise" or src is not buffers[0]:
+            dst = buffers[0]
+        else:
+            if buffers[1] is None:
+                buffers[1] = np.empty_like(src)
+            buffers.reverse()
+            dst = buffers[0]
+        kernel(src, dst, periods)
+        src = dst
+    output = _add_suffix(rebuild(src), "".join(suffix for *_, suffix in kernels))
+    if hasattr(data, "attrs"):
+        output.attrs.update(data.attrs)
+    return output
+
+
+def ts_yoy_pct_change(t_series, freq=None):
+    """ Calculate Year on Year percentage difference.
+
+    Args:
+        t_series (pandas.Series, pandas.DataFrame, numpy.ndarray): Time-series.
+        freq (str, optional): m / q / y. Read from the series metadata if None,
+            required for NumPy arrays. Defaults to None.
+
+    Raises:
+        TypeError: If the frequency is not given and the input has no date index.
+
+    Returns:
+        Same type as t_series: YoY percentage change series.
+    """
+    return _run_fused(t_series, [ts_yoy_pct_change], freq)
+
+
+def ts_log(t_series):
+    return _run_fused(t_series, [ts_log])
+
+
+def ts_first_diff(t_series):
+    return _run_fused(t_series, [ts_first_diff])
+
+
+# Steps PreProcessPipe can fuse: function -> (kernel, kind, needs_freq, name suffix).
+ARRAY_STEPS = {
+    ts_log: (_log_kernel, "elementwise", False, ""),
+    ts_first_diff: (_first_diff_kernel, "shift", False, ""),
+    ts_yoy_pct_change: (_yoy_pct_change_kernel, "shift", True, "_YOY"),
+}
+
+
+def fingerprint(data):
+    """ Content hash of a time-series, its index and labels.
+
+    Args:
+        data (pandas.Series, pandas.DataFrame, numpy.ndarray): Time-series.
+
+    Returns:
+        str: Hex digest.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(type(data).__name__.encode())
+    if isinstance(data, (pd.Series, pd.DataFrame)):
+        digest.update(pd.util.hash_pandas_object(data.index).to_numpy().tobytes())
+        labels = data.columns if isinstance(data, pd.DataFrame) else [data.name]
+        digest.update(repr(list(labels)).encode())
+    arr = np.ascontiguousarray(_to_array(data)[0])
+    digest.update(repr(arr.shape).encode())
+    digest.update(arr.tobytes())
+    return digest.hexdigest()
+
+
+class PreProcessPipe:
+    """ Sequence of pre-processing steps applied to a time-series.
+
+    Steps run on a whole Series, DataFrame or 2-D NumPy array at once.
+    Consecutive steps listed in ARRAY_STEPS are fused into a single pass; any
+    other function is called on the output of the previous step as is.
+
+    Results are cached per input fingerprint and step prefix, so running the
+    pipe again after adding a step only computes the new step.
+    """
+
+    def __init__(self, cache_size=32):
+        """
+
+        Args:
+            cache_size (int, optional): Maximum number of cached results.
+                Defaults to 32.
+        """
+        self.steps = []
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def add_preprocess_step(self, function):
+        self.steps.append(function)
+
+    def show_steps(self):
+        for i, func in enumerate(self.steps):
+            print(f"Step {i}: {func.__name__}")
+
+    def clear_cache(self):
+        self._cache = OrderedDict()
+
+    def _cache_get(self, key):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        return None
+
+    def _cache_set(self, key, output):
+        self._cache[key] = output
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def apply_preprocess(self, t_series, freq=None):
+        """ Apply the pre-processing steps.
+
+        Args:
+            t_series (pandas.Series, pandas.DataFrame, numpy.ndarray): Time-series.
+            freq (str, optional): m / q / y, for frequency dependent steps such as
+                ts_yoy_pct_change. Read from the series metadata if None.
+                Defaults to None.
+
+        Raises:
+            AttributeError: If no step was added.
+
+        Returns:
+            Same type as t_series: Pre-processed time-series.
+        """
+        if not self.steps:
+            raise AttributeError("Pre-process step is None.")
+
+        steps = tuple(self.steps)
+        if freq is None and isinstance(t_series, (pd.Series, pd.DataFrame)):
+            freq = get_date_freq(t_series, infer=False)
+        input_key = (fingerprint(t_series), freq)
+        # Resume from the longest cached step prefix.
+        start = len(steps)
+        while start and self._cache_get((input_key, steps[:start])) is None:
+            start -= 1
+        output = self._cache[(input_key, steps[:start])] if start else t_series
+
+        i = start
+        while i < len(steps):
+            j = i
+            while j < len(steps) and steps[j] in ARRAY_STEPS:
+                j += 1
+            if j > i:
+                output = _run_fused(output, steps[i:j], freq)
+            else:
+                output, j = steps[i](output), i + 1
+            self._cache_set((input_key, steps[:j]), output)
+            i = j
+
+        # Cached results are shared across calls; hand out a copy.
+        return output.copy() if hasattr(output, "copy") else output
+
+
+# %%
@@ -0,0 +1,288 @@
+# %%
+import heapq
+import itertools
+import os
+import pickle
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from manual_var import VectorAR, deterministic_matrix
+from preprocess import PreProcessPipe, fingerprint
+
+# Transformed panels (n_transforms, n_obs, n_vars), set once per process, see
+# _attach_panels.
+_PANELS = None
+_SHM = None
+
+
+def _attach_panels(name, shape):
+    """ Pool initializer: map the shared panels into the worker process.
+    """
+    global _PANELS, _SHM
+    _SHM = shared_memory.SharedMemory(name=name)
+    _PANELS = np.ndarray(shape, dtype=float, buffer=_SHM.buf)
+
+
+def _set_panels(panels):
+    global _PANELS
+    _PANELS = panels
+
+
+def forecast_sse(model, data, n_train, horizon, targets, max_mse=np.inf):
+    """ Sum of squared errors of the target forecasts 1, ..., horizon steps ahead
+    from every origin of the test sample, with the coefficients estimated on the
+    training sample.
+
+    All origins are propagated at once, one horizon at a time; the evaluation
+    stops as soon as the SSE guarantees a mean squared error above max_mse.
+
+    Args:
+        model (VectorAR): Model fitted on data[:n_train].
+        data (numpy.ndarray): (n, k) full sample.
+        n_train (int): Number of training observations; forecasts start from
+            every observation n_train, ..., n - 1.
+        horizon (int): Number of steps ahead.
+        targets (list): Positions of the evaluated variables.
+        max_mse (float, optional): Early stopping threshold. Defaults to np.inf.
+
+    Returns:
+        tuple(float, int): SSE (None if stopped early), number of errors.
+    """
+    n_obs = len(data)
+    p, d = model.p, len(model.det_names)
+    origins = np.arange(n_train, n_obs)
+    n_errors = sum(max(0, len(origins) - step) for step in range(horizon)) * len(targets)
+    # Observation j has trend j + 1, as in the training sample.
+    det = deterministic_matrix(0, n_obs + horizon, model.reg_type) @ model.params[:d]
+    history = sliding_window_view(data, p, axis=0)[n_train - p : n_obs - p].transpose(0, 2, 1)
+    sse = 0.0
+    for step in range(horizon):
+        forecast = det[origins + step] + history[:, ::-1].reshape(len(origins), -1) @ model.params[d:]
+        valid = origins + step < n_obs
+        errors = data[origins[valid] + step][:, targets] - forecast[valid][:, targets]
+        sse += np.sum(errors ** 2)
+        if sse > max_mse * n_errors:
+            return None, n_errors
+        history = np.concatenate((history[:, 1:], forecast[:, None]), axis=1)
+    return sse, n_errors
+
+
+def _evaluate_spec(task):
+    """ Fit one (transform, variables) specification for every candidate lag order.
+
+    The lag orders are ranked by information criterion on a common sample (see
+    VectorAR.select_order); only the keep_lags best are fitted and evaluated
+    out of sample. Rank-deficient systems, e.g. with collinear variables, are
+    reported as errors.
+
+    Returns:
+        tuple: Specification key, result rows, error message (None on success).
+    """
+    key, transform_idx, cols, targets, settings, max_rmse = task
+    try:
+        panel = _PANELS[transform_idx][:, cols]
+        data = panel[~np.isnan(panel).any(axis=1)]
+        n_train = len(data) - settings["test_size"]
+        train = data[:n_train]
+        if np.linalg.matrix_rank(train - train.mean(axis=0)) < len(cols):
+            raise ValueError("Rank-deficient system: collinear or constant variables.")
+        lags = list(settings["lags"])
+        _, table = VectorAR.select_order(train, max(lags), reg_type=settings["reg_type"])
+        ic = settings["ic"]
+        table = table.loc[table.index.isin(lags)]
+        if not np.isfinite(table[ic]).all():
+            raise ValueError("Rank-deficient system: singular residual covariance.")
+
+        rows = []
+        for p in table[ic].nsmallest(settings["keep_lags"]).index:
+            model = VectorAR(data[:n_train], p, reg_type=settings["reg_type"], keep_data=False).fit()
+            sse, n_errors = forecast_sse(model, data, n_train, settings["horizon"], targets, max_rmse ** 2)
+            if sse is None:  # Dominated by the current top N.
+                continue
+            rows.append(
+                {"transform": key[0], "variables": key[1], "p": int(p), **table.loc[p], "rmse": np.sqrt(sse / n_errors)}
+            )
+        return key, rows, None
+    except Exception as err:
+        return key, [], repr(err)
+
+
+def spec_search(
+    panel,
+    targets,
+    transforms,
+    candidates=None,
+    max_extra=2,
+    lags=range(1, 9),
+    test_size=12,
+    horizon=4,
+    ic="aic",
+    top_n=20,
+    keep_lags=3,
+    reg_type="c",
+    n_jobs=None,
+    checkpoint=None,
+    checkpoint_every=50,
+):
+    """ Search VAR specifications over variable subsets, lag orders and transforms.
+
+    Every transform is applied to the whole panel once. The transformed panels
+    are placed in shared memory once, and the worker processes map them on
+    start-up, so a task only carries the positions of its variables. Each
+    specification is the targets plus up to max_extra candidates, under one
+    transform, evaluated for its best lag orders by information criterion.
+    Duplicated columns, targets and candidates are dropped.
+
+    Information criteria only select the lag orders within a specification, as
+    the likelihoods of different variable sets and transforms are not
+    comparable. Specifications are ranked by the out-of-sample forecast rmse of
+    the targets, and one stops being evaluated as soon as its forecast errors
+    exceed those of the current N-th best result. Progress is
+    saved to 'checkpoint' every checkpoint_every specifications, and a search
+    with an existing checkpoint resumes from it. A checkpoint holds a
+    fingerprint of the panel, its transforms, variables and settings; one
+    from a different search is discarded and overwritten. Only the top N
+    results are held.
+
+    Note:
+        Forecast errors are measured on the scale of each transform.
+
+    Args:
+        panel (pandas.DataFrame): Aligned time-series panel.
+        targets (list): Variables in every specification; the forecast errors
+            are measured on them.
+        transforms (dict): Name -> PreProcessPipe or function of the panel.
+        candidates (list, optional): Optional variables. Defaults to None, every
+            other column of the panel.
+        max_extra (int, optional): Largest number of optional variables. Defaults to 2.
+        lags (iterable, optional): Lag orders. Defaults to range(1, 9).
+        test_size (int, optional): Forecast origins held out at the end of each
+            sample. Defaults to 12.
+        horizon (int, optional): Steps ahead forecast from each origin. Defaults to 4.
+        ic (str, optional): Lag order criterion, aic / bic / hqic / fpe.
+            Defaults to "aic".
+        top_n (int, optional): Number of results kept. Defaults to 20.
+        keep_lags (int, optional): Lag orders evaluated per specification. Defaults to 3.
+        reg_type (str, optional): Deterministic terms, see VectorAR. Defaults to "c".
+        n_jobs (int, optional): Number of processes. Defaults to None, no pool.
+        checkpoint (str, optional): Checkpoint file path. Defaults to None.
+        checkpoint_every (int, optional): Specifications between checkpoints.
+            Defaults to 50.
+
+    Returns:
+        tuple(pandas.DataFrame, pandas.DataFrame): Top N results sorted by
+            rmse, errors [Specification, Error].
+    """
+    if ic not in ["aic", "bic", "hqic", "fpe"]:
+        raise ValueError("ic should be: aic / bic / hqic / fpe.")
+    panel = panel.loc[:, ~panel.columns.duplicated()]
+    targets = list(dict.fromkeys(targets))
+    candidates = [
+        col for col in dict.fromkeys(candidates if candidates is not None else panel.columns) if col not in targets
+    ]
+    names = list(transforms)
+    panels = []
+    for name in names:
+        transform = transforms[name]
+        output = transform.apply_preprocess(panel) if isinstance(transform, PreProcessPipe) else transform(panel)
+        panels.append(pd.DataFrame(output).set_axis(panel.columns, axis=1).reindex(panel.index).to_numpy(dtype=float))
+    panels = np.stack(panels)
+
+    columns = list(panel.columns)
+    settings = {
+        "lags": [p for p in lags if p > 0],
+        "test_size": test_size,
+        "horizon": horizon,
+        "ic": ic,
+        "keep_lags": keep_lags,
+        "reg_type": reg_type,
+    }
+    specs = [
+        (name, tuple(targets) + extra)
+        for name in names
+        for n_extra in range(max_extra + 1)
+        for extra in itertools.combinations(candidates, n_extra)
+    ]
+
+    # The transformed panels also cover changes in the transforms themselves.
+    search_key = (
+        fingerprint(panel),
+        fingerprint(panels),
+        targets,
+        candidates,
+        names,
+        max_extra,
+        top_n,
+        sorted(settings.items()),
+    )
+    done, top, errors = set(), [], []
+    if checkpoint is not None and os.path.exists(checkpoint):
+        with open(checkpoint, "rb") as f:
+            saved = pickle.load(f)
+        if saved[0] == search_key:
+            done, top, errors = saved[1:]
+    counter = itertools.count(len(done))
+
+    def save():
+        with open(checkpoint + ".tmp", "wb") as f:
+            pickle.dump((search_key, done, top, errors), f)
+        os.replace(checkpoint + ".tmp", checkpoint)
+
+    def max_rmse():
+        return -top[0][0] if len(top) == top_n else np.inf
+
+    def make_task(spec):
+        cols = [columns.index(var) for var in spec[1]]
+        return spec, names.index(spec[0]), cols, list(range(len(targets))), settings, max_rmse()
+
+    def record(key, rows, error):
+        done.add(key)
+        if error is not None:
+            errors.append({"Specification": key, "Error": error})
+        for row in rows:
+            entry = (-row["rmse"], next(counter), row)
+            if len(top) < top_n:
+                heapq.heappush(top, entry)
+            elif entry[0] > top[0][0]:
+                heapq.heapreplace(top, entry)
+        if checkpoint is not None and len(done) % checkpoint_every == 0:
+            save()
+
+    pending = (spec for spec in specs if spec not in done)
+    if n_jobs:
+        shm = shared_memory.SharedMemory(create=True, size=panels.nbytes)
+        try:
+            np.ndarray(panels.shape, dtype=float, buffer=shm.buf)[:] = panels
+            with ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=_attach_panels, initargs=(shm.name, panels.shape)
+            ) as pool:
+                # Tasks are submitted a few at a time, so that each one is
+                # pruned against the latest top N.
+                running = set()
+                while True:
+                    for spec in itertools.islice(pending, 2 * n_jobs - len(running)):
+                        running.add(pool.submit(_evaluate_spec, make_task(spec)))
+                    if not running:
+                        break
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record(*future.result())
+        finally:
+            shm.close()
+            shm.unlink()
+    else:
+        _set_panels(panels)
+        for spec in pending:
+            record(*_evaluate_spec(make_task(spec)))
+    if checkpoint is not None:
+        save()
+
+    results = pd.DataFrame([row for *_, row in sorted(top, key=lambda entry: -entry[0])])
+    return results, pd.DataFrame(errors, columns=["Specification", "Error"])
+
+
+# %%
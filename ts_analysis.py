@@ -1,8 +1,17 @@
 # %%
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from matplotlib import pyplot as plt
+import numpy as np
 import pandas as pd
 import statsmodels.api as sm
+from numpy.lib.stride_tricks import sliding_window_view
 from statsmodels.tsa.deterministic import DeterministicProcess
+from statsmodels.tsa.adfvalues import mackinnoncrit, mackinnonp
+from statsmodels.tsa.seasonal import DecomposeResult
+
+from api_connect.frequency import N_MONTH, get_date_freq
+from manual_var import DETERMINISTIC_TERMS, lag_matrix
 
 def ts_plot(df):
     """ Time-series plot(s).
@@ -57,41 +66,453 @@ def adf_test(df, regression="c", ci=0.05):
     Returns:
         pd.DataFrame: Test statistic.
     """
+    return panel_adf_test(df, regression, ci)
+
+
+def _adf_design(x, lag, d):
+    """ ADF regressors [deterministic terms, y(t-1), dy(t-1), ..., dy(t-lag)] and
+    dy(t) of a batch of equally long series.
+
+    Args:
+        x (numpy.ndarray): (S, n, 1) series.
+        lag (int): Number of lagged differences.
+        d (int): Number of deterministic terms, see DETERMINISTIC_TERMS.
+
+    Returns:
+        tuple(numpy.ndarray): (S, n - 1 - lag, d + 1 + lag) design, (S, n - 1 - lag) dy(t).
+    """
+    xdiff = np.diff(x, axis=1)
+    nobs = xdiff.shape[1] - lag
+    # The trend is scaled to [0, 1]; statistics are invariant to it.
+    trend = np.arange(1, nobs + 1) / nobs
+    det = np.column_stack([np.ones(nobs), trend, trend ** 2][:d] or [np.empty((nobs, 0))])
+    parts = [
+        np.broadcast_to(det, (len(x), nobs, d)),
+        x[:, lag:-1],
+        lag_matrix(xdiff, lag) if lag else xdiff[:, lag:, :0],
+    ]
+    return np.concatenate(parts, axis=2), xdiff[:, lag:, 0]
+
+
+def _adf_batch(values, regression="c", maxlag=None):
+    """ ADF test of equally long series, as statsmodels adfuller with autolag="AIC".
+
+    All lag orders are compared on the common sample of the largest one, where
+    the nested designs are leading blocks of one Gram matrix per series: a single
+    batched Cholesky factorisation gives the SSR of every lag order. The selected
+    regressions are then refitted on their own samples, batched per lag order.
+    Series whose Gram matrix is singular fall back to adfuller.
+
+    Args:
+        values (numpy.ndarray): (n, S) series without missing values.
+        regression (str, optional): n / c / ct / ctt. Defaults to "c".
+        maxlag (int, optional): Largest lag order. Defaults to None, the
+            adfuller default 12 * (n / 100) ^ (1 / 4).
+
+    Returns:
+        tuple(numpy.ndarray): (S,) ADF statistics, lags used, # of observations.
+    """
+    n_obs, n_series = values.shape
+    d = len(DETERMINISTIC_TERMS[regression])
+    if maxlag is None:
+        maxlag = min(n_obs // 2 - d - 1, int(np.ceil(12.0 * np.power(n_obs / 100.0, 1 / 4.0))))
+        if maxlag < 0:
+            raise ValueError("sample size is too short to use selected regression component")
+    # Statistics and lag selection are scale invariant; scaling conditions the Gram matrices.
+    scale = np.diff(values, axis=0).std(axis=0)
+    x = (values / np.where(scale > 0, scale, 1)).T[:, :, None]
+    try:
+        design, y = _adf_design(x, maxlag, d)
+        design_t = design.swapaxes(1, 2)
+        chol = np.linalg.cholesky(design_t @ design)
+        z = np.linalg.solve(chol, design_t @ y[:, :, None])[:, :, 0]
+        nobs = n_obs - 1 - maxlag
+        ssr = np.sum(y ** 2, axis=1)[:, None] - np.cumsum(z ** 2, axis=1)[:, d:]
+        aic = nobs * (np.log(2 * np.pi) + np.log(ssr / nobs) + 1) + 2 * (d + 1 + np.arange(maxlag + 1))
+        used_lag = np.argmin(aic, axis=1)
+
+        adf_stat = np.empty(n_series)
+        for lag in np.unique(used_lag):
+            series = used_lag == lag
+            design, y = _adf_design(x[series], lag, d)
+            design_t = design.swapaxes(1, 2)
+            gram_inv = np.linalg.inv(design_t @ design)
+            params = (gram_inv @ (design_t @ y[:, :, None]))[:, :, 0]
+            resid = y - (design @ params[:, :, None])[:, :, 0]
+            s2 = np.sum(resid ** 2, axis=1) / (y.shape[1] - design.shape[2])
+            adf_stat[series] = params[:, d] / np.sqrt(s2 * gram_inv[:, d, d])
+    except np.linalg.LinAlgError:
+        results = [sm.tsa.adfuller(values[:, i], maxlag, regression, autolag="AIC") for i in range(n_series)]
+        adf_stat, used_lag, nobs = np.array([res[:4:2] + res[3:4] for res in results]).T
+        return adf_stat, used_lag.astype(int), nobs.astype(int)
+    return adf_stat, used_lag, n_obs - 1 - used_lag
+
+
+def panel_adf_test(df, regression="c", ci=0.05, maxlag=None, n_jobs=None):
+    """ Augmented Dickey Fuller test for unit root of every column, with the lag
+    order selected by AIC.
+
+    Columns with the same number of observations are tested together as one
+    batch of array operations, see _adf_batch.
+
+    Args:
+        df (pd.DataFrame): Time-series; missing values are dropped per column.
+        regression (str, optional): Constant and trend order to include in
+            regression: n / c / ct / ctt. Defaults to "c".
+        ci (float, optional): Confidence interval for test conclusion. Defaults to 0.05.
+        maxlag (int, optional): Largest lag order. Defaults to None, the adfuller default.
+        n_jobs (int, optional): Number of processes the batches are split
+            between. Defaults to None, no pool.
+
+    Returns:
+        pd.DataFrame: Test statistic, as adf_test.
+    """
     if ci not in [0.01, 0.05, 0.1]:
         raise ValueError(
             f"ci input should be either 0.01, 0.05, 0.1. Selected ci is {ci}."
         )
-    output = []
+    if regression not in DETERMINISTIC_TERMS:
+        raise ValueError("regression should be: n / c / ct / ctt.")
+    series = [df[col].dropna().to_numpy(dtype=float) for col in df.columns]
+    groups = {}
+    for i, values in enumerate(series):
+        groups.setdefault(len(values), []).append(i)
+    tasks = [
+        cols
+        for group in groups.values()
+        for cols in np.array_split(group, min(n_jobs or 1, len(group)))
+    ]
+    args = [np.column_stack([series[i] for i in cols]) for cols in tasks]
+    if n_jobs:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_adf_batch, args, repeat(regression), repeat(maxlag)))
+    else:
+        results = [_adf_batch(arg, regression, maxlag) for arg in args]
+
+    rows = {}
+    cv_index = {0.01: 0, 0.05: 1, 0.1: 2}[ci]
     ci = int(ci * 100)
-    for col in df.columns:
-        res = sm.tsa.adfuller(df[col], regression=regression, autolag="AIC")
-        hypot_test = True if res[4].get(f"{ci}%") > res[0] else False
-        res_dict = {
-            "Variable": col,
-            "ADF statistic": res[0],
-            "n_lags": res[2],
-            "p-value": res[1],
-            f"CV {ci}%": res[4].get(f"{ci}%"),
-            "Conclusion": hypot_test,
-        }
-        output.append(res_dict)
-    return pd.DataFrame(output)
-
-def seasonal_decomp(df, period, model= "additive"):
-    for var in df.columns:
-        try:
-            res = sm.tsa.seasonal_decompose(df[var], model=model, period=period)
-            res.plot()
-        except:
-            print(f"Variable: {var} faced an error. Please conduct the decomposition separately for debugging.")
-
-
-def seasonal_adjustment(t_series, period, model="additive"):
-    res = sm.tsa.seasonal_decompose(t_series, model=model, period=period)
-    if model == "additive":
-        sa_series = t_series - res.seasonal
-    elif model == "multiplicative":
-        sa_series = t_series/res.seasonal
+    for cols, (adf_stat, used_lag, nobs) in zip(tasks, results):
+        for i, stat, lag, n in zip(cols, adf_stat, used_lag, nobs):
+            cv = mackinnoncrit(N=1, regression=regression, nobs=n)[cv_index]
+            rows[i] = {
+                "Variable": df.columns[i],
+                "ADF statistic": stat,
+                "n_lags": int(lag),
+                "p-value": mackinnonp(stat, regression=regression, N=1),
+                f"CV {ci}%": cv,
+                "Conclusion": bool(cv > stat),
+            }
+    return pd.DataFrame([rows[i] for i in range(len(series))])
+
+def window_bounds(n_obs, window=None, min_obs=None):
+    """ Observation ranges of a rolling or expanding window.
+
+    Args:
+        n_obs (int): Number of observations.
+        window (int, optional): Rolling window length. Defaults to None, an
+            expanding window.
+        min_obs (int, optional): First length of an expanding window. Defaults
+            to None, a third of the observations.
+
+    Returns:
+        list: (start, end) of each window, end inclusive.
+    """
+    first = window if window is not None else (min_obs or n_obs // 3)
+    if not 0 < first <= n_obs:
+        raise ValueError(f"The first window should have 1 to {n_obs} observations.")
+    return [(end - first + 1 if window else 0, end) for end in range(first - 1, n_obs)]
+
+
+def moving_grams(rows, bounds, refresh=100):
+    """ Gram matrices of a sequence of row ranges, updated incrementally.
+
+    Rows entering a range are added and rows leaving it subtracted, so a step
+    costs O(m^2) per row moved instead of a pass over the range. The Gram matrix
+    is recomputed from the rows every 'refresh' steps to bound rounding drift.
+
+    Args:
+        rows (numpy.ndarray): (n, ..., m) rows, with optional batch axes.
+        bounds (list): (start, stop) row ranges, both non-decreasing.
+        refresh (int, optional): Steps between recomputations. Defaults to 100.
+
+    Yields:
+        numpy.ndarray: (..., m, m) Gram matrix of each range.
+    """
+
+    def gram(block):
+        return np.einsum("t...i,t...j->...ij", block, block)
+
+    for step, (start, stop) in enumerate(bounds):
+        if step % refresh == 0:
+            output = gram(rows[start:stop])
+        else:
+            output = output + gram(rows[prev_stop:stop]) - gram(rows[prev_start:start])
+        prev_start, prev_stop = start, stop
+        yield output
+
+
+def rolling_adf_test(df, regression="c", n_lags=None, window=None, min_obs=None, refresh=100):
+    """ ADF statistics of every column on rolling or expanding windows.
+
+    The lag order of each series is fixed, and the Gram matrix of its ADF
+    regression is updated incrementally as the window moves (see moving_grams),
+    so each step only solves a small system per series.
+
+    Args:
+        df (pd.DataFrame): Time-series; rows with missing values are dropped.
+        regression (str, optional): n / c / ct / ctt. Defaults to "c".
+        n_lags (int, list, optional): Lagged differences per series. Defaults to
+            None, the AIC selection of panel_adf_test on the full sample.
+        window (int, optional): Rolling window length in observations. Defaults
+            to None, an expanding window.
+        min_obs (int, optional): First length of an expanding window, see
+            window_bounds. Defaults to None.
+        refresh (int, optional): Steps between Gram recomputations. Defaults to 100.
+
+    Returns:
+        dict: Paths per window end:
+            * end: Last observation of the window.
+            * adf: (n_windows, k) ADF statistics.
+            * cv: (n_windows, k, 3) 1% / 5% / 10% critical values.
+            * n_lags: (k,) lag orders.
+    """
+    df = df.dropna()
+    data = df.to_numpy(dtype=float)
+    n_obs, n_series = data.shape
+    d = len(DETERMINISTIC_TERMS[regression])
+    if n_lags is None:
+        n_lags = panel_adf_test(df, regression)["n_lags"]
+    n_lags = np.broadcast_to(np.asarray(n_lags, dtype=int), (n_series,))
+    bounds = window_bounds(n_obs, window, min_obs)
+
+    adf = np.full((len(bounds), n_series), np.nan)
+    cv = np.full((len(bounds), n_series, 3), np.nan)
+    for lag in np.unique(n_lags):
+        cols = np.flatnonzero(n_lags == lag)
+        m = d + 1 + lag
+        # Regression row r has dy(t) for t = r + lag; the window [start, end]
+        # holds rows start, ..., end - 1 - lag.
+        row_bounds = [(start, end - lag) for start, end in bounds]
+        if row_bounds[0][1] - row_bounds[0][0] <= m:
+            raise ValueError(f"The first window is too short for {lag} lags.")
+        design, y = _adf_design(data[:, cols].T[:, :, None], lag, d)
+        rows = np.concatenate((design, y[:, :, None]), axis=2).swapaxes(0, 1)
+        for step, gram in enumerate(moving_grams(rows, row_bounds, refresh)):
+            gram_inv = np.linalg.inv(gram[:, :m, :m])
+            params = (gram_inv @ gram[:, :m, m:])[:, :, 0]
+            ssr = gram[:, m, m] - np.sum(gram[:, :m, m] * params, axis=1)
+            nobs = row_bounds[step][1] - row_bounds[step][0]
+            adf[step, cols] = params[:, d] / np.sqrt(ssr / (nobs - m) * gram_inv[:, d, d])
+            cv[step, cols] = mackinnoncrit(N=1, regression=regression, nobs=nobs)
+
+    return {
+        "end": df.index[[end for _, end in bounds]],
+        "adf": adf,
+        "cv": cv,
+        "n_lags": n_lags,
+    }
+
+
+def _ma_decompose(x, period, model="additive"):
+    """ Moving-average seasonal decomposition of all columns of a 2-D array.
+
+    Same method as statsmodels seasonal_decompose: centred moving-average trend,
+    seasonal indices as the per-period means of the detrended series.
+
+    Args:
+        x (numpy.ndarray): (n dates, n columns) array without missing values.
+        period (int): Seasonal period.
+        model (str, optional): additive / multiplicative. Defaults to "additive".
+
+    Returns:
+        tuple(numpy.ndarray): Trend, seasonal, residual arrays.
+    """
+    if period % 2 == 0:  # Split weights at ends.
+        filt = np.array([0.5] + [1] * (period - 1) + [0.5]) / period
+    else:
+        filt = np.repeat(1.0 / period, period)
+    half = len(filt) // 2
+    trend = np.full(x.shape, np.nan)
+    trend[half : len(x) - half] = sliding_window_view(x, len(filt), axis=0) @ filt
+
+    detrended = x / trend if model == "multiplicative" else x - trend
+    n_cycles = -(-len(x) // period)
+    padded = np.full((n_cycles * period, x.shape[1]), np.nan)
+    padded[: len(x)] = detrended
+    period_averages = np.nanmean(padded.reshape(n_cycles, period, -1), axis=0)
+    if model == "multiplicative":
+        period_averages /= period_averages.mean(axis=0)
     else:
+        period_averages -= period_averages.mean(axis=0)
+
+    seasonal = np.tile(period_averages, (n_cycles, 1))[: len(x)]
+    if model == "multiplicative":
+        resid = x / seasonal / trend
+    else:
+        resid = detrended - seasonal
+    return trend, seasonal, resid
+
+
+def _stl_decompose(x, period, model="additive"):
+    """ STL decomposition of one series, see _ma_decompose.
+    Multiplicative decomposition is conducted on the log series.
+    """
+    x = np.log(x) if model == "multiplicative" else x
+    res = sm.tsa.STL(x, period=period).fit()
+    components = (res.trend, res.seasonal, res.resid)
+    if model == "multiplicative":
+        return tuple(np.exp(component) for component in components)
+    return components
+
+
+def _seasonal_period(data, period=None):
+    """ Seasonal period given, or periods per year from the series metadata.
+    """
+    if period is not None:
+        return period
+    date_freq = get_date_freq(data)
+    if date_freq not in N_MONTH:
+        raise ValueError("Seasonal period could not be identified. Please submit the period.")
+    return N_MONTH[date_freq]
+
+
+def batch_seasonal_decompose(df, period=None, model="additive", method="ma", n_jobs=None):
+    """ Seasonal decomposition of every column of a dataframe.
+
+    Each column is decomposed over its own valid date range. With the default
+    moving-average method, columns sharing a date range are decomposed together
+    as 2-D array operations. With the STL method, columns are decomposed one by
+    one, in a process pool if n_jobs is given. Columns that cannot be decomposed
+    are reported in the error table instead of raising.
+
+    Args:
+        df (pandas.DataFrame): Time-series dataframe.
+        period (int, optional): Seasonal period, e.g. 12 for monthly data.
+            Defaults to None, periods per year of the date frequency.
+        model (str, optional): additive / multiplicative. Defaults to "additive".
+        method (str, optional): ma (moving average, as statsmodels
+            seasonal_decompose) / stl. Defaults to "ma".
+        n_jobs (int, optional): Number of processes for the stl method.
+            Defaults to None, no process pool.
+
+    Returns:
+        tuple(dict, pandas.DataFrame): Trend / seasonal / resid dataframes,
+            error table with Variable and Error columns.
+    """
+    if model not in ["additive", "multiplicative"]:
         raise ValueError("Decomposition model type is wrong.")
-    return sa_series.rename(f"{t_series.name}_SA")
+    if method not in ["ma", "stl"]:
+        raise ValueError("Decomposition method should be: ma / stl.")
+    period = _seasonal_period(df, period)
+
+    values = df.to_numpy(dtype=float)
+    components = {
+        name: np.full(values.shape, np.nan) for name in ["trend", "seasonal", "resid"]
+    }
+    errors = []
+    groups = {}
+    for i, col in enumerate(df.columns):
+        valid = np.flatnonzero(~np.isnan(values[:, i]))
+        if not len(valid):
+            errors.append({"Variable": col, "Error": "No observation."})
+            continue
+        start, end = valid[0], valid[-1] + 1
+        if len(valid) < end - start:
+            errors.append({"Variable": col, "Error": "Missing values within the series."})
+        elif end - start < 2 * period:
+            errors.append(
+                {
+                    "Variable": col,
+                    "Error": f"{2 * period} observations (2 complete cycles) are required, "
+                    f"the series has {end - start}.",
+                }
+            )
+        elif model == "multiplicative" and np.any(values[start:end, i] <= 0):
+            errors.append(
+                {
+                    "Variable": col,
+                    "Error": "Multiplicative seasonality is not appropriate for zero and negative values.",
+                }
+            )
+        else:
+            groups.setdefault((start, end), []).append(i)
+
+    if method == "ma":
+        for (start, end), cols in groups.items():
+            result = _ma_decompose(values[start:end, cols], period, model)
+            for name, component in zip(["trend", "seasonal", "resid"], result):
+                components[name][start:end, cols] = component
+    else:
+        tasks = [(start, end, i) for (start, end), cols in groups.items() for i in cols]
+        args = [values[start:end, i] for start, end, i in tasks]
+        if n_jobs:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                results = list(
+                    pool.map(_stl_decompose, args, repeat(period), repeat(model))
+                )
+        else:
+            results = [_stl_decompose(arg, period, model) for arg in args]
+        for (start, end, i), result in zip(tasks, results):
+            for name, component in zip(["trend", "seasonal", "resid"], result):
+                components[name][start:end, i] = component
+
+    components = {
+        name: pd.DataFrame(component, index=df.index, columns=df.columns)
+        for name, component in components.items()
+    }
+    return components, pd.DataFrame(errors, columns=["Variable", "Error"])
+
+
+def seasonal_decomp(df, period=None, model="additive", method="ma"):
+    """ Seasonal decomposition plot(s).
+
+    Returns:
+        pd.DataFrame: Variables which could not be decomposed, with the error.
+    """
+    components, errors = batch_seasonal_decompose(df, period, model, method)
+    for var in df.columns.difference(errors["Variable"], sort=False):
+        valid = df[var].notna()
+        DecomposeResult(
+            observed=df.loc[valid, var],
+            seasonal=components["seasonal"].loc[valid, var],
+            trend=components["trend"].loc[valid, var],
+            resid=components["resid"].loc[valid, var],
+        ).plot()
+    return errors
+
+
+def seasonal_adjustment(t_series, period=None, model="additive", method="ma", n_jobs=None):
+    """ Seasonally adjust a time-series or every column of a dataframe,
+    see batch_seasonal_decompose.
+
+    Args:
+        t_series (pandas.Series, pandas.DataFrame): Time-series.
+        period (int, optional): Seasonal period. Defaults to None, periods per
+            year of the date frequency.
+        model (str, optional): additive / multiplicative. Defaults to "additive".
+        method (str, optional): ma / stl. Defaults to "ma".
+        n_jobs (int, optional): Number of processes for the stl method.
+            Defaults to None.
+
+    Raises:
+        ValueError: If a series cannot be decomposed.
+
+    Returns:
+        pandas.Series, pandas.DataFrame: Seasonally adjusted time-series.
+    """
+    df = t_series.to_frame() if isinstance(t_series, pd.Series) else t_series
+    period = _seasonal_period(t_series, period)
+    components, errors = batch_seasonal_decompose(df, period, model, method, n_jobs)
+    if not errors.empty:
+        raise ValueError(
+            "Seasonal adjustment failed: "
+            + "; ".join(f"{var}: {err}" for var, err in errors.itertuples(index=False))
+        )
+    if model == "additive":
+        sa_df = df - components["seasonal"]
+    else:
+        sa_df = df / components["seasonal"]
+    if isinstance(t_series, pd.Series):
+        return sa_df.iloc[:, 0].rename(f"{t_series.name}_SA")
+    return sa_df.add_suffix("_SA")